@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+import json
+import sys
+import os
+import time
+
+import numpy as np
+
+from q5 import GetQ, GetAllWords, PreprocessRareWords
+from inside_outside import Grammar, spanIndices, viterbiTree
+
+def BatchViterbi(sentences, grammar):
+    """Runs vectorized max-product CKY on sentences of the same length at once
+
+    The charts of all the sentences are stacked on a leading batch axis, so every span length is
+    filled for the whole batch with one set of array operations. Every sentence still gets its
+    own back pointers and its own tree. Returns the trees as JSON, None for a sentence without a
+    parse.
+
+    """
+    B = len(sentences)
+    n = len(sentences[0])
+    assert(all(len(words) == n for words in sentences))
+    K = len(grammar.N)
+    pi = np.full((B, n, n, K), -np.inf)
+    bp_rule = np.full((B, n, n, K), -1, dtype = np.int64)
+    bp_split = np.full((B, n, n, K), -1, dtype = np.int64)
+
+    #################### INITIALIZATION ##########################
+    for b, words in enumerate(sentences):
+        for i in range(n):
+            pi[b, i, i] = grammar.LeafScores(words[i])
+
+    ############## MAIN LOOP OF THE ALGORITHM ##########
+    for l in range(2, n + 1):
+        starts, offsets = spanIndices(n, l)
+
+        # Skip the rules whose children are dead in every sentence of the batch
+        left_cells = pi[:, starts, starts + offsets - 1]
+        right_cells = pi[:, starts + offsets, starts + l - 1]
+        alive_left = np.any(np.isfinite(left_cells), axis = (0, 1, 2))
+        alive_right = np.any(np.isfinite(right_cells), axis = (0, 1, 2))
+        rules = np.flatnonzero(alive_left[grammar.left] & alive_right[grammar.right])
+        if(len(rules) == 0):
+            continue
+        parents = grammar.parent[rules]
+
+        # Shape: (batch, split offsets, starts, rules)
+        scores = (grammar.log_prob[rules] + left_cells[..., grammar.left[rules]] +
+                right_cells[..., grammar.right[rules]])
+
+        # Best split point of every rule, then best rule of every parent
+        best_offset = np.argmax(scores, axis = 1)
+        scores = np.max(scores, axis = 1)
+        starts_of_parents = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+        segment_of_rule = np.cumsum(np.r_[False, parents[1:] != parents[:-1]])
+        max_scores = np.maximum.reduceat(scores, starts_of_parents, axis = 2)
+        position = np.where(scores == max_scores[..., segment_of_rule], np.arange(len(rules)),
+                len(rules))
+        best_position = np.minimum.reduceat(position, starts_of_parents, axis = 2)
+
+        span_starts = starts[0][None, :, None]
+        labels = parents[starts_of_parents][None, None, :]
+        batch = np.arange(B)[:, None, None]
+        best_rule = rules[best_position]
+        # Offset index k - 1 splits the span after words[i + k - 1]
+        best_split = span_starts + np.take_along_axis(best_offset, best_position, axis = 2)
+
+        span_scores = np.full((B, len(starts[0]), K), -np.inf)
+        span_scores[..., parents[starts_of_parents]] = max_scores
+        pi[:, starts[0], starts[0] + l - 1] = span_scores
+        bp_rule[batch, span_starts, span_starts + l - 1, labels] = best_rule
+        bp_split[batch, span_starts, span_starts + l - 1, labels] = best_split
+
+    ##################### BUILD THE PARSE TREES OUT OF BACKPOINTERS ####################
+    parse_trees = list()
+    for b, words in enumerate(sentences):
+        # Handling the case where the sentence is a fragment
+        root_candidates = grammar.RootCandidates(pi[b, 0, n - 1])
+        if(len(root_candidates) == 0):
+            parse_trees.append(None)
+            continue
+        root = root_candidates[np.argmax(pi[b, 0, n - 1, root_candidates])]
+        parse_trees.append(json.dumps(viterbiTree(words, grammar, bp_rule[b], bp_split[b], root,
+            0, n - 1)))
+    return parse_trees
+
+def peakCells(n, num_rules):
+    """Returns the size of the largest score array of one sentence of n words in BatchViterbi
+
+    The scores of span length l have (l - 1) split offsets for n - l + 1 starts and every rule,
+    which is largest for l = n / 2 + 1.
+
+    """
+    return (n // 2) * ((n + 1) // 2) * num_rules
+
+def Batches(sentences = None, max_batch_size = 64, num_rules = None, max_cells = 2 ** 22):
+    """Groups the indices of the sentences by length into batches of at most `max_batch_size`
+
+    With `num_rules`, a batch is also capped so that its largest score array has at most
+    `max_cells` float64 entries (32 MB by default): long sentences go in small batches, and a
+    sentence that exceeds the budget alone gets a batch of its own.
+
+    """
+    by_length = dict()
+    for index, words in enumerate(sentences):
+        by_length.setdefault(len(words), list()).append(index)
+
+    batches = list()
+    for n in sorted(by_length):
+        indices = by_length[n]
+        batch_size = max_batch_size
+        if(num_rules is not None):
+            batch_size = max(1, min(max_batch_size, max_cells // max(1, peakCells(n, num_rules))))
+        for k in range(0, len(indices), batch_size):
+            batches.append(indices[k:k + batch_size])
+    return batches
+
+def ParseTestData(test_data_file_name = None, counts_file_name = None,
+        test_predictions_file_name = None, max_batch_size = 64, max_cells = 2 ** 22):
+    """Computes the parse trees for the test data in batches of sentences of the same length
+
+    The size of the batches is capped by `max_batch_size` and by the memory budget `max_cells`
+    (see Batches). The trees are written in the order of the test data.
+
+    """
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    grammar = Grammar(*GetQ(counts_file_name = counts_file_name))
+
+    sentences = list()
+    with open(test_data_file_name, "r") as f_test_data_input:
+        for line in f_test_data_input:
+            words = line.strip().split()
+            PreprocessRareWords(words = words, all_words = all_words)
+            sentences.append(words)
+
+    parse_trees = [None] * len(sentences)
+    for batch in Batches(sentences = sentences, max_batch_size = max_batch_size,
+            num_rules = len(grammar.binary_rules), max_cells = max_cells):
+        for index, parse_tree_as_json in zip(batch, BatchViterbi(
+                [sentences[index] for index in batch], grammar)):
+            parse_trees[index] = parse_tree_as_json
+
+    with open(test_predictions_file_name, "w+") as f_test_data_output:
+        for parse_tree_as_json in parse_trees:
+            # Same as CKY, which asserts that every sentence has a root
+            assert(parse_tree_as_json is not None)
+            f_test_data_output.write(parse_tree_as_json + "\n")
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python batch_cky.py parse_train.RARE.dat parse_dev.dat q5_prediction_file [max_batch_size]
+    train_file_name = sys.argv[1]
+    test_file_name = sys.argv[2]
+    test_predictions_file_name = sys.argv[3]
+    max_batch_size = int(sys.argv[4]) if(len(sys.argv) > 4) else 64
+    counts_file_name = "cfg_batch.counts"
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    start_time = time.time()
+    ParseTestData(test_data_file_name = test_file_name, counts_file_name = counts_file_name,
+            test_predictions_file_name = test_predictions_file_name,
+            max_batch_size = max_batch_size)
+    sys.stderr.write("Parsed %s in %.1fs\n" % (test_file_name, time.time() - start_time))
+
+    # Delete the counts file
+    os.system("rm -rf %s" % (counts_file_name))
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+import json
+import sys
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from q5 import GetQ, GetAllWords, PreprocessRareWords
+from inside_outside import Grammar, Viterbi, ChartArena, ROOT_NON_TERMINAL
+
+# Settings of the worker processes, set once by initWorker
+worker_grammar = None
+worker_settings = None
+worker_arena = None
+
+def EstimateCost(n, cost_per_cell = None):
+    """Estimated seconds to parse a sentence of `n` words: CKY is cubic in the length"""
+    return cost_per_cell * n ** 3
+
+def CalibrateCost(grammar, words):
+    """Times a full parse of `words` and returns the estimated seconds per n^3"""
+    start_time = time.time()
+    Viterbi(words, grammar)
+    return (time.time() - start_time) / len(words) ** 3
+
+def FlatTree(words, grammar):
+    """Returns a right branching tree over the words as JSON
+
+    Used when a sentence cannot be parsed within its budget. Every word gets its most probable
+    preterminal, the internal nodes are labelled with the root non-terminal.
+
+    """
+    preterminals = [grammar.N[int(np.argmax(grammar.LeafScores(word)))] for word in words]
+    tree = [preterminals[-1], words[-1]]
+    for word, X in zip(reversed(words[:-1]), reversed(preterminals[:-1])):
+        tree = [ROOT_NON_TERMINAL, [X, word], tree]
+    return json.dumps(tree)
+
+def initWorker(grammar, settings):
+    """Stores the grammar, the scheduling settings and a chart arena in the worker process"""
+    global worker_grammar, worker_settings, worker_arena
+    worker_grammar = grammar
+    worker_settings = settings
+    worker_arena = ChartArena(grammar)
+
+def parseWithBudget(task):
+    """Parses one sentence in a worker process within the time budget
+
+    A sentence whose estimated cost fits in the budget gets a full parse. A sentence over the
+    budget, or whose full parse runs out of time, gets a beam pruned parse with a budget of its
+    own: the beam drops the non-terminals out of the best `beam` of every span, so they are never
+    scored as children of longer spans. If that parse also runs out of time or finds no tree, the
+    sentence falls back to a flat tree. Returns the index of the sentence with its tree and the
+    method used.
+
+    """
+    index, words = task
+    time_budget = worker_settings["time_budget"]
+
+    parse_tree_as_json = None
+    method = "full"
+    if(time_budget is None or
+            EstimateCost(len(words), worker_settings["cost_per_cell"]) <= time_budget):
+        deadline = time.time() + time_budget if(time_budget is not None) else None
+        parse_tree_as_json = Viterbi(words, worker_grammar, deadline = deadline,
+                arena = worker_arena)
+
+    if(parse_tree_as_json is None and time_budget is not None):
+        method = "pruned"
+        parse_tree_as_json = Viterbi(words, worker_grammar, beam = worker_settings["beam"],
+                deadline = time.time() + time_budget, arena = worker_arena)
+
+    if(parse_tree_as_json is None):
+        method = "flat"
+        parse_tree_as_json = FlatTree(words, worker_grammar)
+    return index, parse_tree_as_json, method
+
+def ScheduleParse(test_data_file_name = None, counts_file_name = None,
+        test_predictions_file_name = None, processes = None, time_budget = None, beam = 10):
+    """Computes the parse trees for the test data, longest sentences first
+
+    The sentences are dispatched to a process pool in decreasing order of length, so the
+    expensive ones start first and the short ones fill the gaps at the end of the batch. Every
+    sentence gets `time_budget` seconds (no limit if None), see parseWithBudget. The trees are
+    written in the order of the test data.
+
+    """
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    grammar = Grammar(*GetQ(counts_file_name = counts_file_name))
+
+    sentences = list()
+    with open(test_data_file_name, "r") as f_test_data_input:
+        for line in f_test_data_input:
+            words = line.strip().split()
+            PreprocessRareWords(words = words, all_words = all_words)
+            sentences.append(words)
+
+    # Longest first: the cost of a sentence grows with the cube of its length
+    tasks = sorted(enumerate(sentences), key = lambda task: len(task[1]), reverse = True)
+
+    # Calibrate the cost model on a sentence of median length
+    settings = {"time_budget": time_budget, "beam": beam, "cost_per_cell": None}
+    if(time_budget is not None):
+        settings["cost_per_cell"] = CalibrateCost(grammar, tasks[len(tasks) // 2][1])
+
+    parse_trees = [None] * len(sentences)
+    methods = dict()
+    with Pool(processes = processes, initializer = initWorker,
+            initargs = (grammar, settings)) as pool:
+        for index, parse_tree_as_json, method in pool.imap_unordered(
+                parseWithBudget, tasks):
+            parse_trees[index] = parse_tree_as_json
+            methods[method] = methods.get(method, 0) + 1
+
+    # Restore the order of the test data
+    with open(test_predictions_file_name, "w+") as f_test_data_output:
+        for parse_tree_as_json in parse_trees:
+            f_test_data_output.write(parse_tree_as_json + "\n")
+
+    return methods
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python batch_scheduler.py parse_train.RARE.dat parse_dev.dat q5_prediction_file
+    #       [time_budget] [processes]
+    train_file_name = sys.argv[1]
+    test_file_name = sys.argv[2]
+    test_predictions_file_name = sys.argv[3]
+    time_budget = float(sys.argv[4]) if(len(sys.argv) > 4) else None
+    processes = int(sys.argv[5]) if(len(sys.argv) > 5) else None
+    counts_file_name = "cfg_schedule.counts"
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    methods = ScheduleParse(test_data_file_name = test_file_name,
+            counts_file_name = counts_file_name,
+            test_predictions_file_name = test_predictions_file_name, processes = processes,
+            time_budget = time_budget)
+    sys.stderr.write("Parsed sentences by method: %s\n" % (methods))
+
+    # Delete the counts file
+    os.system("rm -rf %s" % (counts_file_name))
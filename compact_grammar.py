@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+import json
+import sys
+import os
+import time
+
+from q5 import PreprocessRareWords
+from inside_outside import Grammar, Viterbi, ROOT_NON_TERMINAL, simplify_non_terminal
+from em_train import ReadCounts, WriteCounts, EstimateQ
+from batch_scheduler import FlatTree
+from treebank import Treebank, Sentences
+
+def reachableNonTerminals(binary_counts = None, root = ROOT_NON_TERMINAL):
+    """Returns the non-terminals that can be derived from `root` with the binary rules"""
+    children = dict()
+    for X, Y, Z in binary_counts:
+        children.setdefault(X, set()).update((Y, Z))
+
+    reachable = {root}
+    stack = [root]
+    while(len(stack) != 0):
+        X = stack.pop()
+        for Y in children.get(X, ()):
+            if(Y not in reachable):
+                reachable.add(Y)
+                stack.append(Y)
+    return reachable
+
+def productiveNonTerminals(unary_counts = None, binary_counts = None):
+    """Returns the non-terminals that derive at least one string of words (fixpoint)"""
+    productive = {X for X, W in unary_counts}
+    changed = True
+    while(changed):
+        changed = False
+        for X, Y, Z in binary_counts:
+            if(X not in productive and Y in productive and Z in productive):
+                productive.add(X)
+                changed = True
+    return productive
+
+def CompactCounts(nonterm_counts = None, unary_counts = None, binary_counts = None,
+        min_count = 2):
+    """Drops the low count binary rules and the useless non-terminals from the counts
+
+    Binary rules seen fewer than `min_count` times are dropped. Then the non-terminals that are
+    unreachable from S or derive no words are removed with every rule that mentions them, until
+    nothing changes. The count of every remaining non-terminal becomes the total count of its
+    remaining rules, so the relative frequency estimates of GetQ are renormalized. Unary rules
+    are only dropped with their non-terminal.
+
+    """
+    binary_counts = {rule: count for rule, count in binary_counts.items() if count >= min_count}
+    unary_counts = dict(unary_counts)
+
+    while(True):
+        useful = reachableNonTerminals(binary_counts = binary_counts) & productiveNonTerminals(
+                unary_counts = unary_counts, binary_counts = binary_counts)
+        compact_binary = {(X, Y, Z): count for (X, Y, Z), count in binary_counts.items()
+                if(X in useful and Y in useful and Z in useful)}
+        if(len(compact_binary) == len(binary_counts)):
+            break
+        binary_counts = compact_binary
+
+    # Words left without a preterminal are parsed as _RARE_
+    unary_counts = {(X, W): count for (X, W), count in unary_counts.items() if(X in useful)}
+
+    # Renormalize: the count of X is what is left of its expansions
+    compact_nonterm = dict()
+    for rule, count in list(binary_counts.items()) + list(unary_counts.items()):
+        compact_nonterm[rule[0]] = compact_nonterm.get(rule[0], 0.0) + count
+
+    return compact_nonterm, unary_counts, binary_counts
+
+def convertToSpans(tree, start, spans):
+    """Adds the spans (X, i, j) of the tree to `spans`, same as eval_parser.convert_to_spans"""
+    X = simplify_non_terminal(tree[0])
+    if(len(tree) == 3):
+        split = convertToSpans(tree[1], start, spans)
+        end = convertToSpans(tree[2], split + 1, spans)
+        spans.add((X, start, end))
+        return end
+    spans.add((X, start, start))
+    return start
+
+def SpanF1(key_trees = None, prediction_trees = None):
+    """Returns the labelled span F1 of the predictions, as the total row of eval_parser.py"""
+    right = 0
+    total_gold = 0
+    total_test = 0
+    for key_tree, prediction_tree in zip(key_trees, prediction_trees):
+        key_spans = set()
+        prediction_spans = set()
+        convertToSpans(key_tree, 1, key_spans)
+        convertToSpans(prediction_tree, 1, prediction_spans)
+        right += len(key_spans & prediction_spans)
+        total_gold += len(key_spans)
+        total_test += len(prediction_spans)
+    p = right / float(total_test)
+    r = right / float(total_gold)
+    return (2 * p * r) / (p + r) if(p + r > 0) else 0.0
+
+def ParseWithCounts(sentences = None, nonterm_counts = None, unary_counts = None,
+        binary_counts = None):
+    """Parses the raw sentences with the grammar of the counts, returns the trees and the time
+
+    Sentences the grammar cannot parse any more get a flat tree.
+
+    """
+    q_binary_rules, q_unary_rules, N = EstimateQ(nonterm_counts = nonterm_counts,
+            unary_counts = unary_counts, binary_counts = binary_counts)
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    all_words = {W for X, W in q_unary_rules}
+
+    trees = list()
+    start_time = time.time()
+    for sentence in sentences:
+        words = list(sentence)
+        PreprocessRareWords(words = words, all_words = all_words)
+        parse_tree_as_json = Viterbi(words, grammar)
+        if(parse_tree_as_json is None):
+            parse_tree_as_json = FlatTree(words, grammar)
+        trees.append(json.loads(parse_tree_as_json))
+    return trees, time.time() - start_time
+
+def SizeAccuracyReport(counts_file_name = None, test_data_file_name = None,
+        key_file_name = None, thresholds = (1, 2, 3, 5, 10)):
+    """Prints the grammar size, the parsing time and the F1 for every count threshold"""
+    nonterm_counts, unary_counts, binary_counts = ReadCounts(counts_file_name = counts_file_name)
+    sentences = list(Sentences(test_data_file_name))
+    key_trees = list(Treebank(key_file_name))
+
+    print("%10s  %10s  %10s  %10s  %10s" % ("Threshold", "Binary", "NonTerm", "Seconds", "F1 Score"))
+    print("===============================================================")
+    for min_count in thresholds:
+        compact_nonterm, compact_unary, compact_binary = CompactCounts(
+                nonterm_counts = nonterm_counts, unary_counts = unary_counts,
+                binary_counts = binary_counts, min_count = min_count)
+        trees, seconds = ParseWithCounts(sentences = sentences, nonterm_counts = compact_nonterm,
+                unary_counts = compact_unary, binary_counts = compact_binary)
+        print("%10d  %10d  %10d  %10.1f  %10.3f" % (min_count, len(compact_binary),
+            len(compact_nonterm), seconds, SpanF1(key_trees = key_trees, prediction_trees = trees)))
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # Report:  python compact_grammar.py report parse_train_vert.RARE.dat parse_dev.dat parse_dev.key
+    # Compact: python compact_grammar.py compact parse_train_vert.RARE.dat cfg_compact.counts 3
+    mode = sys.argv[1]
+    train_file_name = sys.argv[2]
+    counts_file_name = "cfg_compact_train.counts"
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    if(mode == "report"):
+        SizeAccuracyReport(counts_file_name = counts_file_name, test_data_file_name = sys.argv[3],
+                key_file_name = sys.argv[4])
+    elif(mode == "compact"):
+        nonterm_counts, unary_counts, binary_counts = CompactCounts(
+                *ReadCounts(counts_file_name = counts_file_name), min_count = float(sys.argv[4]))
+        WriteCounts(counts_file_name = sys.argv[3], nonterm_counts = nonterm_counts,
+                unary_counts = unary_counts, binary_counts = binary_counts)
+
+    # Delete the counts file
+    os.system("rm -rf %s" % (counts_file_name))
@@ -4,6 +4,7 @@ __author__="Alexander Rush <srush@csail.mit.edu>"
 __date__ ="$Sep 12, 2012"
 
 import sys, json
+from treebank import Treebank
 
 """
 Count rule frequencies in a binarized CFG.
@@ -55,8 +56,7 @@ class Counts:
 
 def main(parse_file):
   counter = Counts() 
-  for l in open(parse_file):
-    t = json.loads(l)
+  for t in Treebank(parse_file):
     counter.count(t)
   counter.show()
 
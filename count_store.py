@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import json
+import sys
+import os
+import time
+
+from treebank import Treebank
+from em_train import WriteCounts
+
+# A word is a rare word if Count(x) < 5, as in q4.getRareWords
+RARE_THRESHOLD = 5
+RARE_KEYWORD = '_RARE_'
+
+class CountStore:
+    """Persisted counts of a treebank that can be extended with new trees
+
+    Keeps the counts of the original trees (non-terminals, binary rules, X -> word rules with
+    the real words) and derives from them the counts of the treebank after rare word
+    replacement, i.e. the counts count_cfg_freq.py would produce on the output of q4. When trees
+    are appended, only the counts they touch are updated: the words whose count reaches
+    RARE_THRESHOLD move out of the _RARE_ rules, and only the parameters of the non-terminals whose
+    counts changed are recomputed.
+
+    Usage:
+        store = CountStore("treebank.store")
+        store.AddTrees(Treebank("new_trees.dat"))
+        store.Save()
+        q_binary_rules, q_unary_rules, N = store.GetQ()
+
+    """
+    def __init__(self, file_name = None):
+        self.file_name = file_name
+
+        # Counts of the original trees
+        self.nonterm = dict()
+        self.binary = dict()
+        self.lexical = dict()
+        self.word = dict()
+
+        if(file_name is not None and os.path.exists(file_name)):
+            self.load()
+        self.rebuildDerived()
+
+    def load(self):
+        """Reads the counts of the original trees from the store file"""
+        with open(self.file_name, "r") as f_store:
+            stored = json.load(f_store)
+        self.nonterm = {X: count for X, count in stored["nonterm"]}
+        self.binary = {(X, Y, Z): count for X, Y, Z, count in stored["binary"]}
+        self.lexical = {(X, W): count for X, W, count in stored["lexical"]}
+        self.word = dict()
+        for (X, W), count in self.lexical.items():
+            self.word[W] = self.word.get(W, 0) + count
+
+    def Save(self, file_name = None):
+        """Writes the counts of the original trees to the store file"""
+        file_name = file_name or self.file_name
+        stored = {"nonterm": [[X, count] for X, count in self.nonterm.items()],
+                  "binary": [[X, Y, Z, count] for (X, Y, Z), count in self.binary.items()],
+                  "lexical": [[X, W, count] for (X, W), count in self.lexical.items()]}
+
+        # Write to a temporary file first so that a crash never leaves a truncated store
+        with open(file_name + ".tmp", "w+") as f_store:
+            json.dump(stored, f_store)
+        os.replace(file_name + ".tmp", file_name)
+
+    def rebuildDerived(self):
+        """Computes the rare word replaced counts and all the parameters from scratch"""
+        self.unary = dict()
+        for (X, W), count in self.lexical.items():
+            rule = (X, self.replaced(W))
+            self.unary[rule] = self.unary.get(rule, 0) + count
+
+        self.binary_by_parent = dict()
+        for rule in self.binary:
+            self.binary_by_parent.setdefault(rule[0], set()).add(rule)
+        self.unary_by_parent = dict()
+        for rule in self.unary:
+            self.unary_by_parent.setdefault(rule[0], set()).add(rule)
+        self.lexical_by_word = dict()
+        for X, W in self.lexical:
+            self.lexical_by_word.setdefault(W, set()).add(X)
+
+        self.q_binary_rules = dict()
+        self.q_unary_rules = dict()
+        self.updateQ(self.nonterm)
+
+    def replaced(self, word):
+        """Returns the word as it appears in the rare word replaced treebank"""
+        return word if(self.word.get(word, 0) >= RARE_THRESHOLD) else RARE_KEYWORD
+
+    def countTree(self, tree, lexical_delta, affected):
+        """Adds the counts of the tree, collects the X -> word counts in `lexical_delta`"""
+        X = tree[0]
+        self.nonterm[X] = self.nonterm.get(X, 0) + 1
+        affected.add(X)
+        if(len(tree) == 3):
+            rule = (X, tree[1][0], tree[2][0])
+            if(rule not in self.binary):
+                self.binary[rule] = 0
+                self.binary_by_parent.setdefault(X, set()).add(rule)
+            self.binary[rule] += 1
+            self.countTree(tree[1], lexical_delta, affected)
+            self.countTree(tree[2], lexical_delta, affected)
+        elif(len(tree) == 2):
+            rule = (X, tree[1])
+            lexical_delta[rule] = lexical_delta.get(rule, 0) + 1
+        else:
+            raise Exception("CountStore: Tree's length is not valid")
+
+    def addUnary(self, rule, count):
+        """Adds `count` to a rare word replaced unary rule, drops the rule if it reaches zero"""
+        self.unary[rule] = self.unary.get(rule, 0) + count
+        self.unary_by_parent.setdefault(rule[0], set()).add(rule)
+        if(self.unary[rule] == 0):
+            del self.unary[rule]
+            self.unary_by_parent[rule[0]].discard(rule)
+            self.q_unary_rules.pop(rule, None)
+
+    def AddTrees(self, trees = None):
+        """Adds the counts of the trees, returns the affected non-terminals and the new frequent words
+
+        Every non-terminal of the new trees has a new count, so its parameters are recomputed. A
+        word whose count reaches RARE_THRESHOLD stops being _RARE_: its X -> word counts are moved
+        out of X -> _RARE_. The parameters of all the other non-terminals are left untouched.
+
+        """
+        affected = set()
+        lexical_delta = dict()
+        for tree in trees:
+            self.countTree(tree, lexical_delta, affected)
+
+        word_before = dict()
+        for (X, W), count in lexical_delta.items():
+            if(W not in word_before):
+                word_before[W] = self.word.get(W, 0)
+            self.word[W] = self.word.get(W, 0) + count
+            self.lexical[(X, W)] = self.lexical.get((X, W), 0) + count
+            self.lexical_by_word.setdefault(W, set()).add(X)
+
+        # Words that were rare before these trees and are not any more
+        new_frequent_words = {W for W, count in word_before.items()
+                if(count < RARE_THRESHOLD and self.word[W] >= RARE_THRESHOLD)}
+
+        for (X, W), count in lexical_delta.items():
+            if(W not in new_frequent_words):
+                self.addUnary((X, self.replaced(W)), count)
+
+        for W in new_frequent_words:
+            for X in self.lexical_by_word[W]:
+                # The part of the count seen before these trees was counted as _RARE_
+                old_count = self.lexical[(X, W)] - lexical_delta.get((X, W), 0)
+                if(old_count > 0):
+                    self.addUnary((X, RARE_KEYWORD), -old_count)
+                self.addUnary((X, W), self.lexical[(X, W)])
+                affected.add(X)
+
+        self.updateQ(affected)
+        return affected, new_frequent_words
+
+    def updateQ(self, non_terminals):
+        """Recomputes the maximum likelihood estimates of the rules of the given non-terminals"""
+        for X in non_terminals:
+            for rule in self.binary_by_parent.get(X, ()):
+                self.q_binary_rules[rule] = self.binary[rule] / self.nonterm[X]
+            for rule in self.unary_by_parent.get(X, ()):
+                self.q_unary_rules[rule] = self.unary[rule] / self.nonterm[X]
+
+    def GetQ(self):
+        """Returns the parameters in the same form as GetQ in q5.py"""
+        return self.q_binary_rules, self.q_unary_rules, list(self.nonterm.keys())
+
+    def GetAllWords(self):
+        """Returns the words of the rare word replaced treebank, same as GetAllWords in q5.py"""
+        return {W for X, W in self.unary}
+
+    def WriteCounts(self, counts_file_name = None):
+        """Writes the rare word replaced counts, same content as count_cfg_freq.py on q4's output"""
+        WriteCounts(counts_file_name = counts_file_name, nonterm_counts = self.nonterm,
+                unary_counts = self.unary, binary_counts = self.binary)
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE: python count_store.py treebank.store new_trees.dat [cfg.counts]
+    # Creates the store if it does not exist, adds the trees of new_trees.dat (the original
+    # trees, without rare word replacement) and optionally writes the counts for q5/q6
+    store_file_name = sys.argv[1]
+    trees_file_name = sys.argv[2]
+
+    start_time = time.time()
+    store = CountStore(store_file_name)
+    with Treebank(trees_file_name) as trees:
+        affected, new_frequent_words = store.AddTrees(trees)
+    store.Save()
+    if(len(sys.argv) > 3):
+        store.WriteCounts(counts_file_name = sys.argv[3])
+
+    sys.stderr.write("Updated %d non-terminals, %d words are no longer rare (%.1fs)\n" % (
+        len(affected), len(new_frequent_words), time.time() - start_time))
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import json
+import math
+import random
+import sys
+import os
+import time
+
+from q5 import GetQ, GetAllWords, PreprocessRareWords, CKY
+from inside_outside import Grammar, Viterbi, ChartArena, ROOT_NON_TERMINAL
+from batch_cky import BatchViterbi
+from span_constraints import SpanConstraints
+from treebank import Sentences
+
+def viterbiEngine(q_binary_rules, q_unary_rules, N):
+    """Vectorized CKY of inside_outside.py"""
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    return lambda words: Viterbi(words, grammar)
+
+def batchEngine(q_binary_rules, q_unary_rules, N):
+    """Batched CKY of batch_cky.py, one sentence per batch"""
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    return lambda words: BatchViterbi([words], grammar)[0]
+
+def arenaEngine(q_binary_rules, q_unary_rules, N):
+    """Vectorized CKY reusing one preallocated chart for all the sentences"""
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    arena = ChartArena(grammar)
+    return lambda words: Viterbi(words, grammar, arena = arena)
+
+def constrainedCKYEngine(q_binary_rules, q_unary_rules, N):
+    """CKY of q5.py skipping the cells and split points ruled out by the span constraints"""
+    constraints = SpanConstraints(q_binary_rules, q_unary_rules, N)
+    return lambda words: CKY(words, q_binary_rules, q_unary_rules, N, constraints = constraints)
+
+def beamEngine(q_binary_rules, q_unary_rules, N):
+    """Vectorized CKY keeping the 10 best non-terminals of every span (not exact)"""
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    return lambda words: Viterbi(words, grammar, beam = 10)
+
+# Indexed by the name of the engine: builds a parser words -> JSON tree from the parameters of
+# GetQ. Register new engines here to check them against CKY.
+ENGINES = {
+    "viterbi": viterbiEngine,
+    "batch": batchEngine,
+    "arena": arenaEngine,
+    "constrained_cky": constrainedCKYEngine,
+    "beam": beamEngine,
+}
+
+def TreeLogProb(tree, q_binary_rules, q_unary_rules):
+    """Returns the log probability of the tree under the grammar, -inf if it uses unknown rules"""
+    if(len(tree) == 2):
+        q = q_unary_rules.get((tree[0], tree[1]), 0.0)
+        return math.log(q) if(q > 0) else -math.inf
+    q = q_binary_rules.get((tree[0], tree[1][0], tree[2][0]), 0.0)
+    if(q == 0):
+        return -math.inf
+    return (math.log(q) + TreeLogProb(tree[1], q_binary_rules, q_unary_rules) +
+            TreeLogProb(tree[2], q_binary_rules, q_unary_rules))
+
+def GenerateSentences(q_binary_rules = None, q_unary_rules = None, count = 100,
+        max_length = 20, seed = 0):
+    """Samples sentences from the grammar, rooted at S, of at most `max_length` words
+
+    The samples use the words of the grammar (including _RARE_), so they need no preprocessing.
+
+    """
+    expansions = dict()
+    for rule, q in list(q_binary_rules.items()) + list(q_unary_rules.items()):
+        expansions.setdefault(rule[0], list()).append((rule, q))
+
+    rng = random.Random(seed)
+    sentences = list()
+    while(len(sentences) != count):
+        words = list()
+        stack = [ROOT_NON_TERMINAL]
+        while(len(stack) != 0 and len(words) <= max_length):
+            X = stack.pop()
+            rules, weights = zip(*expansions[X])
+            rule = rng.choices(rules, weights = weights)[0]
+            if(len(rule) == 3):
+                stack.append(rule[2])
+                stack.append(rule[1])
+            else:
+                words.append(rule[1])
+        if(len(stack) == 0 and len(words) <= max_length):
+            sentences.append(words)
+    return sentences
+
+def timedParse(engine, words):
+    """Runs the engine on a copy of the words, returns the tree (None on failure) and the time"""
+    start_time = time.time()
+    try:
+        parse_tree_as_json = engine(list(words))
+    except AssertionError:
+        # CKY asserts that the sentence has a root
+        parse_tree_as_json = None
+    return parse_tree_as_json, time.time() - start_time
+
+def CompareEngines(sentences = None, q_binary_rules = None, q_unary_rules = None, N = None,
+        candidate = "viterbi", tolerance = 1e-9):
+    """Runs CKY and the candidate engine on every sentence and compares the results
+
+    For every sentence the status is one of:
+        match     - same tree
+        tie       - different trees with the same Viterbi score (within `tolerance`)
+        mismatch  - different trees and different scores
+        failure   - exactly one of the engines returned no tree
+    Returns one result per sentence: (index, length, status, reference score, candidate score,
+    reference seconds, candidate seconds).
+
+    """
+    engine = ENGINES[candidate](q_binary_rules, q_unary_rules, N)
+    results = list()
+    for index, words in enumerate(sentences):
+        reference_tree, reference_time = timedParse(
+                lambda words: CKY(words, q_binary_rules, q_unary_rules, N), words)
+        candidate_tree, candidate_time = timedParse(engine, words)
+
+        reference_score = candidate_score = -math.inf
+        if(reference_tree is not None):
+            reference_score = TreeLogProb(json.loads(reference_tree), q_binary_rules,
+                    q_unary_rules)
+        if(candidate_tree is not None):
+            candidate_score = TreeLogProb(json.loads(candidate_tree), q_binary_rules,
+                    q_unary_rules)
+
+        if(reference_tree == candidate_tree):
+            status = "match"
+        elif(reference_tree is None or candidate_tree is None):
+            status = "failure"
+        elif(abs(reference_score - candidate_score) <= tolerance * max(1.0, abs(reference_score))):
+            status = "tie"
+        else:
+            status = "mismatch"
+        results.append((index, len(words), status, reference_score, candidate_score,
+            reference_time, candidate_time))
+    return results
+
+def PrintReport(results = None, name = None):
+    """Prints the sentences that are not an exact match and a summary of the comparison"""
+    print("%s" % (name))
+    print("%6s  %6s  %8s  %12s  %12s  %9s  %9s" % ("Index", "Length", "Status", "CKY score",
+        "Cand. score", "CKY s", "Cand. s"))
+    print("=" * 75)
+    for index, n, status, reference_score, candidate_score, reference_time, candidate_time in \
+            results:
+        if(status != "match"):
+            print("%6d  %6d  %8s  %12.4f  %12.4f  %9.3f  %9.3f" % (index, n, status,
+                reference_score, candidate_score, reference_time, candidate_time))
+
+    statuses = [result[2] for result in results]
+    reference_total = sum(result[5] for result in results)
+    candidate_total = sum(result[6] for result in results)
+    print("")
+    print("%d sentences: %d match, %d tie, %d mismatch, %d failure" % (len(results),
+        statuses.count("match"), statuses.count("tie"), statuses.count("mismatch"),
+        statuses.count("failure")))
+    print("CKY %.2fs, candidate %.2fs, speedup %.1fx" % (reference_total, candidate_total,
+        reference_total / max(candidate_total, 1e-9)))
+    print("")
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python diff_engines.py parse_train.RARE.dat parse_dev.dat viterbi [max_length] [generated]
+    # Exits with status 1 if any sentence is a mismatch or a failure
+    train_file_name = sys.argv[1]
+    test_file_name = sys.argv[2]
+    candidate = sys.argv[3]
+    max_length = int(sys.argv[4]) if(len(sys.argv) > 4) else 15
+    generated = int(sys.argv[5]) if(len(sys.argv) > 5) else 100
+    counts_file_name = "cfg_diff.counts"
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    q_binary_rules, q_unary_rules, N = GetQ(counts_file_name = counts_file_name)
+    os.system("rm -rf %s" % (counts_file_name))
+
+    # The reference CKY is slow, so only the sentences up to `max_length` words are compared
+    test_sentences = list()
+    for words in Sentences(test_file_name):
+        if(len(words) <= max_length):
+            PreprocessRareWords(words = words, all_words = all_words)
+            test_sentences.append(words)
+    generated_sentences = GenerateSentences(q_binary_rules = q_binary_rules,
+            q_unary_rules = q_unary_rules, count = generated, max_length = max_length)
+
+    failed = False
+    for name, sentences in [(test_file_name, test_sentences), ("generated", generated_sentences)]:
+        results = CompareEngines(sentences = sentences, q_binary_rules = q_binary_rules,
+                q_unary_rules = q_unary_rules, N = N, candidate = candidate)
+        PrintReport(results = results, name = "%s: CKY vs %s" % (name, candidate))
+        failed = failed or any(result[2] in ("mismatch", "failure") for result in results)
+    sys.exit(1 if(failed) else 0)
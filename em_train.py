@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import time
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+from q5 import GetAllWords, PreprocessRareWords
+from inside_outside import Grammar, Inside, Outside, spanIndices
+
+# Grammar used by the worker processes, set once per iteration by initWorker
+worker_grammar = None
+
+def ReadCounts(counts_file_name = None):
+    """Reads a counts file into dictionaries of non-terminal, unary rule and binary rule counts
+
+    Same format as the output of count_cfg_freq.py. The counts are read as floats so that the
+    checkpoints written by WriteCounts can be read back.
+
+    """
+    nonterm_counts = dict()
+    unary_counts = dict()
+    binary_counts = dict()
+    with open(counts_file_name, "r") as f_counts:
+        for line in f_counts:
+            tokens = line.strip().split()
+            if(tokens[1] == "NONTERMINAL"):
+                nonterm_counts[tokens[2]] = float(tokens[0])
+            elif(tokens[1] == "UNARYRULE"):
+                unary_counts[(tokens[2], tokens[3])] = float(tokens[0])
+            elif(tokens[1] == "BINARYRULE"):
+                binary_counts[(tokens[2], tokens[3], tokens[4])] = float(tokens[0])
+    return nonterm_counts, unary_counts, binary_counts
+
+def WriteCounts(counts_file_name = None, nonterm_counts = None, unary_counts = None,
+        binary_counts = None):
+    """Writes the counts in the format of count_cfg_freq.py, readable by GetQ"""
+    with open(counts_file_name, "w+") as f_counts:
+        for X, count in nonterm_counts.items():
+            f_counts.write("%r NONTERMINAL %s\n" % (float(count), X))
+        for (X, W), count in unary_counts.items():
+            f_counts.write("%r UNARYRULE %s %s\n" % (float(count), X, W))
+        for (X, Y, Z), count in binary_counts.items():
+            f_counts.write("%r BINARYRULE %s %s %s\n" % (float(count), X, Y, Z))
+
+def EstimateQ(nonterm_counts = None, unary_counts = None, binary_counts = None):
+    """Relative frequency estimates from the counts, same parameters as GetQ"""
+    q_binary_rules = {rule: count / nonterm_counts[rule[0]]
+            for rule, count in binary_counts.items() if count > 0}
+    q_unary_rules = {rule: count / nonterm_counts[rule[0]]
+            for rule, count in unary_counts.items() if count > 0}
+    return q_binary_rules, q_unary_rules, list(nonterm_counts.keys())
+
+def ExpectedCounts(words, grammar):
+    """Computes the expected rule counts of a single sentence under the grammar
+
+    Returns the expected count of every binary rule (array aligned with the rules of
+    `grammar`), a dictionary of expected unary rule counts and the log probability of the
+    sentence. A sentence the grammar cannot parse contributes no counts.
+
+    """
+    n = len(words)
+    binary_counts = np.zeros(len(grammar.parent))
+    unary_counts = dict()
+
+    inside = Inside(words, grammar)
+    outside, log_Z = Outside(words, grammar, inside)
+    if(not np.isfinite(log_Z)):
+        return binary_counts, unary_counts, log_Z
+
+    # Binary rules: outside(parent) * q(rule) * inside(left) * inside(right) / Z over all splits
+    for l in range(2, n + 1):
+        starts, offsets = spanIndices(n, l)
+        parent_scores = outside[starts[0], starts[0] + l - 1][..., grammar.parent]
+        left_scores = inside[starts, starts + offsets - 1][..., grammar.left]
+        right_scores = inside[starts + offsets, starts + l - 1][..., grammar.right]
+        scores = parent_scores + grammar.log_prob + left_scores + right_scores - log_Z
+        binary_counts += np.exp(scores).sum(axis = (0, 1))
+
+    # Unary rules: posterior of X spanning the single word
+    for i in range(n):
+        posteriors = np.exp(inside[i, i] + outside[i, i] - log_Z)
+        for X in np.flatnonzero(posteriors > 0):
+            rule = (grammar.N[X], words[i])
+            unary_counts[rule] = unary_counts.get(rule, 0.0) + posteriors[X]
+
+    return binary_counts, unary_counts, log_Z
+
+def initWorker(grammar):
+    """Stores the grammar of the current iteration in the worker process"""
+    global worker_grammar
+    worker_grammar = grammar
+
+def expectedCountsOfChunk(sentences):
+    """Sums the expected counts of a chunk of sentences in a worker process"""
+    binary_counts = np.zeros(len(worker_grammar.parent))
+    unary_counts = dict()
+    log_likelihood = 0.0
+    parsed = 0
+    for words in sentences:
+        sentence_binary, sentence_unary, log_Z = ExpectedCounts(words, worker_grammar)
+        if(not np.isfinite(log_Z)):
+            continue
+        binary_counts += sentence_binary
+        for rule, count in sentence_unary.items():
+            unary_counts[rule] = unary_counts.get(rule, 0.0) + count
+        log_likelihood += log_Z
+        parsed += 1
+    return binary_counts, unary_counts, log_likelihood, parsed
+
+def ReadRawSentences(raw_text_file_name = None, all_words = None, max_length = None):
+    """Reads one sentence per line, replaces rare words and drops sentences over `max_length`"""
+    sentences = list()
+    with open(raw_text_file_name, "r") as f_raw:
+        for line in f_raw:
+            words = line.strip().split()
+            if(len(words) == 0 or (max_length is not None and len(words) > max_length)):
+                continue
+            PreprocessRareWords(words = words, all_words = all_words)
+            sentences.append(words)
+    return sentences
+
+def EMTrain(counts_file_name = None, raw_text_file_name = None, output_counts_file_name = None,
+        iterations = 5, processes = None, treebank_weight = 1.0, max_length = None,
+        chunk_size = 16, initial_counts_file_name = None, first_iteration = 1):
+    """Re-estimates the grammar of `counts_file_name` with EM on unannotated sentences
+
+    Every iteration computes the expected rule counts of the raw sentences with inside-outside,
+    in parallel over chunks of sentences with a process pool, and merges them. The new counts are
+    the expected counts plus `treebank_weight` times the treebank counts, so the rules keep the
+    support of the treebank grammar. After every iteration the grammar is checkpointed to
+    `output_counts_file_name`.iter<k>. The final grammar is written to `output_counts_file_name`.
+
+    `counts_file_name` always holds the treebank counts. To resume a run, pass its last checkpoint
+    as `initial_counts_file_name`, the grammar the first E step uses, and the number of the next
+    iteration as `first_iteration`.
+
+    """
+    treebank_nonterm, treebank_unary, treebank_binary = ReadCounts(
+            counts_file_name = counts_file_name)
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    sentences = ReadRawSentences(raw_text_file_name = raw_text_file_name, all_words = all_words,
+            max_length = max_length)
+
+    # Longest sentences first so that the expensive chunks do not finish last
+    sentences.sort(key = len, reverse = True)
+    chunks = [sentences[k:k + chunk_size] for k in range(0, len(sentences), chunk_size)]
+
+    new_nonterm, new_unary, new_binary = treebank_nonterm, treebank_unary, treebank_binary
+    if(initial_counts_file_name is not None):
+        new_nonterm, new_unary, new_binary = ReadCounts(counts_file_name = initial_counts_file_name)
+    grammar = Grammar(*EstimateQ(nonterm_counts = new_nonterm, unary_counts = new_unary,
+        binary_counts = new_binary))
+
+    for iteration in range(first_iteration, first_iteration + iterations):
+        start_time = time.time()
+
+        ################ E STEP #####################
+        binary_counts = np.zeros(len(grammar.parent))
+        unary_counts = dict()
+        log_likelihood = 0.0
+        parsed = 0
+        with Pool(processes = processes, initializer = initWorker, initargs = (grammar,)) as pool:
+            for chunk_binary, chunk_unary, chunk_log_likelihood, chunk_parsed in \
+                    pool.imap_unordered(expectedCountsOfChunk, chunks):
+                binary_counts += chunk_binary
+                for rule, count in chunk_unary.items():
+                    unary_counts[rule] = unary_counts.get(rule, 0.0) + count
+                log_likelihood += chunk_log_likelihood
+                parsed += chunk_parsed
+
+        ################ M STEP #####################
+        new_binary = {rule: treebank_weight * count for rule, count in treebank_binary.items()}
+        for index, rule in enumerate(grammar.binary_rules):
+            new_binary[rule] = new_binary.get(rule, 0.0) + binary_counts[index]
+        new_unary = {rule: treebank_weight * count for rule, count in treebank_unary.items()}
+        for rule, count in unary_counts.items():
+            new_unary[rule] = new_unary.get(rule, 0.0) + count
+
+        # Count of X = expected number of times X is expanded by any rule
+        new_nonterm = {X: 0.0 for X in treebank_nonterm}
+        for rule, count in new_binary.items():
+            new_nonterm[rule[0]] += count
+        for rule, count in new_unary.items():
+            new_nonterm[rule[0]] += count
+
+        WriteCounts(counts_file_name = "%s.iter%d" % (output_counts_file_name, iteration),
+                nonterm_counts = new_nonterm, unary_counts = new_unary,
+                binary_counts = new_binary)
+        grammar = Grammar(*EstimateQ(nonterm_counts = new_nonterm, unary_counts = new_unary,
+            binary_counts = new_binary))
+
+        sys.stderr.write("Iteration %d: log likelihood %.2f over %d/%d sentences (%.1fs)\n" % (
+            iteration, log_likelihood, parsed, len(sentences), time.time() - start_time))
+
+    WriteCounts(counts_file_name = output_counts_file_name, nonterm_counts = new_nonterm,
+            unary_counts = new_unary, binary_counts = new_binary)
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python em_train.py parse_train.RARE.dat raw_sentences.dat cfg_em.counts [iterations]
+    #       [processes] [checkpoint] [first_iteration]
+    # Resume after the 3rd iteration (first_iteration is read from the .iter<k> suffix):
+    # python em_train.py parse_train.RARE.dat raw_sentences.dat cfg_em.counts 2 4 cfg_em.counts.iter3
+    # Continue from the final grammar of a 5 iteration run:
+    # python em_train.py parse_train.RARE.dat raw_sentences.dat cfg_em2.counts 2 4 cfg_em.counts 6
+    train_file_name = sys.argv[1]
+    raw_text_file_name = sys.argv[2]
+    output_counts_file_name = sys.argv[3]
+    iterations = int(sys.argv[4]) if(len(sys.argv) > 4) else 5
+    processes = int(sys.argv[5]) if(len(sys.argv) > 5) else None
+    initial_counts_file_name = sys.argv[6] if(len(sys.argv) > 6) else None
+    first_iteration = 1
+    if(len(sys.argv) > 7):
+        first_iteration = int(sys.argv[7])
+    elif(initial_counts_file_name is not None):
+        suffix = initial_counts_file_name.rsplit(".iter", 1)[-1]
+        if(initial_counts_file_name == suffix or not suffix.isdigit()):
+            sys.stderr.write("Usage: the checkpoint %s has no .iter<k> suffix, pass the number "
+                    "of the first iteration after it\n" % (initial_counts_file_name))
+            sys.exit(1)
+        first_iteration = int(suffix) + 1
+
+    # Generate the treebank counts in a temporary file, never named like the output
+    f_counts, counts_file_name = tempfile.mkstemp(suffix = ".counts", dir = ".")
+    os.close(f_counts)
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    EMTrain(counts_file_name = counts_file_name, raw_text_file_name = raw_text_file_name,
+            output_counts_file_name = output_counts_file_name, iterations = iterations,
+            processes = processes, initial_counts_file_name = initial_counts_file_name,
+            first_iteration = first_iteration)
+
+    # Delete the treebank counts file
+    os.remove(counts_file_name)
@@ -3,15 +3,16 @@
 __author__="Alexander Rush <srush@csail.mit.edu>"
 __date__ ="$Sep 12, 2012"
 
-import sys, re, json, itertools
+import sys, re, json
+from treebank import Treebank
 
 """
 Evaluate a set of test parses versus the gold set. 
 """
 
 def simplify_non_terminal(nt):
-  "Remove the vertical markovization." 
-  return re.sub(r"\^<.*?>", '', nt)
+  "Remove the vertical (^<...>) and horizontal (|<...>) markovization." 
+  return re.sub(r"(\^|\|)<.*?>", '', nt)
 
 
 def convert_to_spans(tree, start, set): 
@@ -36,6 +37,13 @@ def output_row(name, right, total_gold, total_test):
   r = right / float(total_gold)
   print "%10s        %4d     %0.3f        %0.3f        %0.3f"%(name, total_gold, p, r, (2 * p * r) / float(p + r))
 
+def check_lines(file_name, trees):
+  "Fail if the file has blank lines: the reader skips them, which would misalign the trees."
+  total_lines = sum(1 for line in open(file_name))
+  if total_lines != len(trees):
+    print >>sys.stderr, "%s has %d blank lines" % (file_name, total_lines - len(trees))
+    sys.exit(1)
+
 def main(key_file, prediction_file):
   right = 0
   total_gold = 0
@@ -44,15 +52,23 @@ def main(key_file, prediction_file):
   nt_total_gold = {}
   nt_total_test = {}
 
-  for l1, l2 in itertools.izip(open(key_file), open(prediction_file)):
+  key_trees = Treebank(key_file)
+  prediction_trees = Treebank(prediction_file)
+  check_lines(key_file, key_trees)
+  check_lines(prediction_file, prediction_trees)
+  if len(key_trees) != len(prediction_trees):
+    print >>sys.stderr, "%s has %d trees but %s has %d" % (key_file, len(key_trees),
+                                                           prediction_file, len(prediction_trees))
+    sys.exit(1)
+  for k in range(len(key_trees)):
     set1 = set()
     set2 = set()
-    tree1 = json.loads(l1)
-    tree2 = json.loads(l2)
+    tree1 = key_trees[k]
+    tree2 = prediction_trees[k]
     len1 = convert_to_spans(tree1, 1, set1)
     len2 = convert_to_spans(tree2, 1, set2)
     if len1 != len2: 
-      print >>sys.stderr, "Sentence length does not match", l1, l2 
+      print >>sys.stderr, "Sentence length does not match", key_trees.Line(k), prediction_trees.Line(k)
     
     # Compute precision, recall.
     for (nt, i, j) in set1 & set2:
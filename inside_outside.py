@@ -0,0 +1,575 @@
+#!/usr/bin/python3
+
+import json
+import re
+import sys
+import os
+import time
+
+import numpy as np
+
+from q5 import GetQ, GetAllWords, PreprocessRareWords
+
+# Root non-terminal preferred by CKY when the sentence is not a fragment
+ROOT_NON_TERMINAL = 'S'
+
+class Grammar:
+    """Array view of the parameters returned by GetQ
+
+    The non-terminals are numbered in the order of `N`. The binary rules are stored as parallel
+    arrays (parent, left child, right child, log probability) sorted by the parent, and every word
+    of the training data is mapped to a vector of log probabilities over the non-terminals. All the
+    scores are kept in log space, an impossible rule has a score of -inf.
+
+    """
+    def __init__(self, q_binary_rules, q_unary_rules, N):
+        self.N = list(N)
+        self.nt_index = {X: index for index, X in enumerate(self.N)}
+
+        # Sorting by the parent keeps the rules of every non-terminal contiguous
+        binary_rules = sorted(q_binary_rules, key = lambda rule: self.nt_index[rule[0]])
+        self.binary_rules = binary_rules
+        self.parent = np.array([self.nt_index[X] for X, Y, Z in binary_rules], dtype = np.int64)
+        self.left = np.array([self.nt_index[Y] for X, Y, Z in binary_rules], dtype = np.int64)
+        self.right = np.array([self.nt_index[Z] for X, Y, Z in binary_rules], dtype = np.int64)
+        self.log_prob = np.log(np.array([q_binary_rules[rule] for rule in binary_rules],
+            dtype = np.float64))
+
+        # Indexed by a word: vector of log q(X -> word) over all the non-terminals
+        self.lexicon = dict()
+        for (X, W), q in q_unary_rules.items():
+            if(W not in self.lexicon):
+                self.lexicon[W] = np.full(len(self.N), -np.inf)
+            self.lexicon[W][self.nt_index[X]] = np.log(q)
+
+    def LeafScores(self, word):
+        """Returns the log probabilities of X -> word for all the non-terminals"""
+        if(word in self.lexicon):
+            return self.lexicon[word]
+        return np.full(len(self.N), -np.inf)
+
+    def RootCandidates(self, root_scores):
+        """Returns the indices of the non-terminals allowed at the root of the sentence
+
+        Mirrors CKY: the sentence is rooted at S whenever S spans it, otherwise it is a fragment
+        and any non-terminal spanning the whole sentence can be its root.
+
+        """
+        S = self.nt_index.get(ROOT_NON_TERMINAL)
+        if(S is not None and np.isfinite(root_scores[S])):
+            return np.array([S])
+        return np.flatnonzero(np.isfinite(root_scores))
+
+
+class ChartArena:
+    """Viterbi chart preallocated once and reused for every sentence
+
+    Holds the scores and the back pointers of CKY as flat typed arrays for sentences of up to
+    `max_length` words. Chart(n) only resets the scores of the n x n corner used by the next
+    sentence; the back pointers need no reset since they are only read where the scores were
+    written. The arena grows (once) if a longer sentence comes in. Meant to be owned by a single
+    worker and passed to Viterbi for every sentence it parses.
+
+    """
+    def __init__(self, grammar, max_length = 64):
+        self.K = len(grammar.N)
+        self.allocate(max_length)
+
+    def allocate(self, max_length):
+        self.max_length = max_length
+        self.pi = np.empty((max_length, max_length, self.K))
+        self.bp_rule = np.empty((max_length, max_length, self.K), dtype = np.int32)
+        self.bp_split = np.empty((max_length, max_length, self.K), dtype = np.int32)
+
+    def Chart(self, n):
+        """Returns the (pi, bp_rule, bp_split) views for a sentence of `n` words"""
+        if(n > self.max_length):
+            self.allocate(max(n, 2 * self.max_length))
+        pi = self.pi[:n, :n]
+        pi.fill(-np.inf)
+        return pi, self.bp_rule[:n, :n], self.bp_split[:n, :n]
+
+
+def simplify_non_terminal(nt):
+    "Remove the vertical (^<...>) and horizontal (|<...>) markovization."
+    return re.sub(r"(\^|\|)<.*?>", '', nt)
+
+def segmentLogSumExp(scores, labels, size):
+    """Log-sum-exp of the last axis of `scores` grouped by `labels`
+
+    `scores` has the rules on the last axis, `labels` gives the non-terminal every rule
+    contributes to. Returns an array with the last axis of length `size`, labels that receive no
+    rule get -inf.
+
+    """
+    out = np.full(scores.shape[:-1] + (size,), -np.inf)
+    if(len(labels) == 0):
+        return out
+
+    order = np.argsort(labels, kind = "stable")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    segment_of_rule = np.cumsum(np.r_[False, sorted_labels[1:] != sorted_labels[:-1]])
+
+    sorted_scores = scores[..., order]
+    max_scores = np.maximum.reduceat(sorted_scores, starts, axis = -1)
+    safe_max = np.where(np.isfinite(max_scores), max_scores, 0.0)
+    totals = np.add.reduceat(np.exp(sorted_scores - safe_max[..., segment_of_rule]), starts,
+            axis = -1)
+    with np.errstate(divide = "ignore"):
+        out[..., sorted_labels[starts]] = safe_max + np.log(totals)
+    return out
+
+def segmentMax(scores, labels, size):
+    """Max of the last axis of `scores` grouped by `labels`, same layout as segmentLogSumExp"""
+    out = np.full(scores.shape[:-1] + (size,), -np.inf)
+    if(len(labels) == 0):
+        return out
+
+    order = np.argsort(labels, kind = "stable")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    out[..., sorted_labels[starts]] = np.maximum.reduceat(scores[..., order], starts, axis = -1)
+    return out
+
+def spanIndices(n, l):
+    """Returns the starts and the split offsets of all the spans of length `l`
+
+    Every span of length `l` is (i, i + l - 1) and is split into (i, i + k - 1) and
+    (i + k, i + l - 1) for k in 1 .. l - 1. Returned as arrays broadcastable to (k, i).
+
+    """
+    starts = np.arange(n - l + 1)[None, :]
+    offsets = np.arange(1, l)[:, None]
+    return starts, offsets
+
+def Inside(words, grammar, mask = None):
+    """Computes the inside scores of the sentence in log space
+
+    Returns an array `inside` where inside[i, j, X] is the log of the total probability of X
+    deriving words[i .. j]. All the spans of the same length are filled in one vectorized step.
+    If a boolean `mask` of the same shape is given, the cells where it is False are pruned.
+
+    """
+    n = len(words)
+    K = len(grammar.N)
+    inside = np.full((n, n, K), -np.inf)
+
+    #################### INITIALIZATION ##########################
+    for i in range(n):
+        inside[i, i] = grammar.LeafScores(words[i])
+    if(mask is not None):
+        inside[~mask] = -np.inf
+
+    ############## MAIN LOOP OF THE ALGORITHM ##########
+    for l in range(2, n + 1):
+        starts, offsets = spanIndices(n, l)
+
+        # Shape: (split offsets, starts, rules)
+        left_scores = inside[starts, starts + offsets - 1][..., grammar.left]
+        right_scores = inside[starts + offsets, starts + l - 1][..., grammar.right]
+        scores = grammar.log_prob + left_scores + right_scores
+
+        # Sum over the split points, then over the rules of every parent
+        max_scores = np.max(scores, axis = 0)
+        safe_max = np.where(np.isfinite(max_scores), max_scores, 0.0)
+        with np.errstate(divide = "ignore"):
+            scores = safe_max + np.log(np.sum(np.exp(scores - safe_max), axis = 0))
+        span_scores = segmentLogSumExp(scores, grammar.parent, K)
+
+        if(mask is not None):
+            span_scores[~mask[starts[0], starts[0] + l - 1]] = -np.inf
+        inside[starts[0], starts[0] + l - 1] = span_scores
+
+    return inside
+
+def Outside(words, grammar, inside):
+    """Computes the outside scores of the sentence in log space given its inside scores
+
+    Returns `outside` (same shape as `inside`) and the log probability of the sentence. The
+    root gets an outside score of 0 for the non-terminals returned by Grammar.RootCandidates.
+
+    """
+    n = len(words)
+    K = len(grammar.N)
+    outside = np.full((n, n, K), -np.inf)
+
+    root_candidates = grammar.RootCandidates(inside[0, n - 1])
+    outside[0, n - 1, root_candidates] = 0.0
+    log_Z = np.logaddexp.reduce(inside[0, n - 1, root_candidates]) if(
+            len(root_candidates) != 0) else -np.inf
+
+    # Longer spans are finished before any of their children is used as a parent
+    for l in range(n, 1, -1):
+        starts, offsets = spanIndices(n, l)
+
+        parent_scores = outside[starts[0], starts[0] + l - 1][..., grammar.parent]
+        left_scores = inside[starts, starts + offsets - 1][..., grammar.left]
+        right_scores = inside[starts + offsets, starts + l - 1][..., grammar.right]
+        parent_scores = parent_scores + grammar.log_prob
+
+        # Every (start, offset) pair addresses a different child span
+        to_left = segmentLogSumExp(parent_scores + right_scores, grammar.left, K)
+        to_right = segmentLogSumExp(parent_scores + left_scores, grammar.right, K)
+        outside[starts, starts + offsets - 1] = np.logaddexp(
+                outside[starts, starts + offsets - 1], to_left)
+        outside[starts + offsets, starts + l - 1] = np.logaddexp(
+                outside[starts + offsets, starts + l - 1], to_right)
+
+    return outside, log_Z
+
+def Marginals(words, grammar, mask = None):
+    """Returns the posterior marginals of all the labelled spans of the sentence
+
+    marginals[i, j, X] is the posterior probability that X spans words[i .. j] in a parse of the
+    sentence. Cells below the diagonal are always zero.
+
+    """
+    inside = Inside(words, grammar, mask = mask)
+    outside, log_Z = Outside(words, grammar, inside)
+    if(not np.isfinite(log_Z)):
+        return np.zeros(inside.shape)
+    with np.errstate(invalid = "ignore"):
+        marginals = np.exp(inside + outside - log_Z)
+    return np.nan_to_num(marginals, nan = 0.0)
+
+def PosteriorDecode(words, grammar, marginals = None):
+    """Runs max-recall decoding on the sentence, returns the tree as JSON
+
+    Picks the binary tree whose labelled spans have the largest sum of posterior marginals. Every
+    span takes its most probable label, the root is restricted to the labels CKY would allow.
+    Returns None if the sentence has no parse, like Viterbi.
+
+    """
+    n = len(words)
+    if(marginals is None):
+        marginals = Marginals(words, grammar)
+    # Marginals are all zero when the sentence has no parse
+    if(not np.any(marginals[0, n - 1] > 0)):
+        return None
+
+    labels = np.argmax(marginals, axis = 2)
+    span_scores = np.max(marginals, axis = 2)
+
+    # The root follows the same rules as the Viterbi root
+    with np.errstate(divide = "ignore"):
+        root_candidates = grammar.RootCandidates(np.log(marginals[0, n - 1]))
+    if(len(root_candidates) != 0):
+        labels[0, n - 1] = root_candidates[np.argmax(marginals[0, n - 1, root_candidates])]
+        span_scores[0, n - 1] = marginals[0, n - 1, labels[0, n - 1]]
+
+    # best[i][j] is the max expected recall of the spans inside words[i .. j]
+    best = np.zeros((n, n))
+    split = np.zeros((n, n), dtype = np.int64)
+    for i in range(n):
+        best[i, i] = span_scores[i, i]
+    for l in range(2, n + 1):
+        for i in range(0, n - l + 1):
+            j = i + l - 1
+            candidates = best[i, i:j] + best[i + 1:j + 1, j]
+            split[i, j] = i + int(np.argmax(candidates))
+            best[i, j] = span_scores[i, j] + np.max(candidates)
+
+    return json.dumps(posteriorTree(words, grammar, labels, split, 0, n - 1))
+
+def posteriorTree(words, grammar, labels, split, i, j):
+    """Builds the tree of the span (i, j) out of the labels and the splits"""
+    X = grammar.N[labels[i, j]]
+    if(i == j):
+        return [X, words[i]]
+    s = split[i, j]
+    return [X, posteriorTree(words, grammar, labels, split, i, s),
+            posteriorTree(words, grammar, labels, split, s + 1, j)]
+
+def PruningMask(marginals = None, threshold = 1e-4):
+    """Keeps the labelled spans whose (max-)marginal is at least `threshold`"""
+    return marginals >= threshold
+
+def ProjectMask(mask = None, coarse_grammar = None, fine_grammar = None):
+    """Maps a pruning mask computed with the coarse grammar to the labels of the fine grammar
+
+    A fine label (e.g. NP^<S>) inherits the mask of its coarse label (NP), found by removing the
+    vertical markovization. Fine labels without a coarse counterpart are never pruned.
+
+    """
+    n = mask.shape[0]
+    fine_mask = np.ones((n, n, len(fine_grammar.N)), dtype = bool)
+    for index, X in enumerate(fine_grammar.N):
+        coarse_index = coarse_grammar.nt_index.get(simplify_non_terminal(X))
+        if(coarse_index is not None):
+            fine_mask[:, :, index] = mask[:, :, coarse_index]
+    return fine_mask
+
+def Viterbi(words, grammar, mask = None, beam = None, deadline = None, arena = None):
+    """Runs vectorized max-product CKY in log space, returns the tree as JSON
+
+    Same tree as CKY up to ties. A rule is only scored in the cells where its children are alive
+    for some split point and, if a boolean `mask` is given, where the mask keeps its parent, which
+    is where the second pass of coarse-to-fine parsing saves its time. If `beam` is given, every
+    span keeps only its `beam` best non-terminals. Returns None if no tree survives the pruning,
+    or if time.time() passes `deadline` before the chart is full. If a ChartArena is given, the
+    chart is taken from it instead of being allocated.
+
+    """
+    chart = viterbiChart(words, grammar, mask = mask, beam = beam, deadline = deadline,
+            arena = arena)
+    if(chart is None):
+        return None
+    pi, bp_rule, bp_split = chart
+
+    # Handling the case where the sentence is a fragment
+    n = len(words)
+    root_candidates = grammar.RootCandidates(pi[0, n - 1])
+    if(len(root_candidates) == 0):
+        return None
+    root = root_candidates[np.argmax(pi[0, n - 1, root_candidates])]
+    return json.dumps(viterbiTree(words, grammar, bp_rule, bp_split, root, 0, n - 1))
+
+def viterbiChart(words, grammar, mask = None, beam = None, deadline = None, arena = None):
+    """Fills the Viterbi chart, returns (pi, bp_rule, bp_split), None if the deadline passes"""
+    n = len(words)
+    K = len(grammar.N)
+    if(arena is not None):
+        pi, bp_rule, bp_split = arena.Chart(n)
+    else:
+        pi = np.full((n, n, K), -np.inf)
+        bp_rule = np.full((n, n, K), -1, dtype = np.int64)
+        bp_split = np.full((n, n, K), -1, dtype = np.int64)
+
+    #################### INITIALIZATION ##########################
+    for i in range(n):
+        pi[i, i] = grammar.LeafScores(words[i])
+    if(mask is not None):
+        pi[~mask] = -np.inf
+
+    ############## MAIN LOOP OF THE ALGORITHM ##########
+    for l in range(2, n + 1):
+        if(deadline is not None and time.time() > deadline):
+            return None
+        starts, offsets = spanIndices(n, l)
+        left_cells = pi[starts, starts + offsets - 1]
+        right_cells = pi[starts + offsets, starts + l - 1]
+
+        # Score a rule at a start only if its children are alive there in some split and, with a
+        # mask, its parent is not pruned in that cell
+        left_alive = np.any(np.isfinite(left_cells), axis = 0)
+        right_alive = np.any(np.isfinite(right_cells), axis = 0)
+        alive = left_alive[:, grammar.left] & right_alive[:, grammar.right]
+        if(mask is not None):
+            alive &= mask[starts[0], starts[0] + l - 1][:, grammar.parent]
+        # Pairs sorted by start, then by rule, i.e. by cell (start, parent)
+        pair_start, pair_rule = np.nonzero(alive)
+        if(len(pair_rule) == 0):
+            continue
+        pair_parent = grammar.parent[pair_rule]
+
+        # Shape: (split offsets, pairs)
+        scores = (grammar.log_prob[pair_rule] + left_cells[:, pair_start, grammar.left[pair_rule]] +
+                right_cells[:, pair_start, grammar.right[pair_rule]])
+
+        # Best split point of every pair, then best rule of every cell
+        best_offset = np.argmax(scores, axis = 0)
+        scores = np.max(scores, axis = 0)
+        new_cell = np.r_[True, (pair_start[1:] != pair_start[:-1]) |
+                (pair_parent[1:] != pair_parent[:-1])]
+        starts_of_cells = np.flatnonzero(new_cell)
+        cell_of_pair = np.cumsum(new_cell) - 1
+        max_scores = np.maximum.reduceat(scores, starts_of_cells)
+        position = np.where(scores == max_scores[cell_of_pair], np.arange(len(pair_rule)),
+                len(pair_rule))
+        best_pair = np.minimum.reduceat(position, starts_of_cells)
+
+        cell_starts = pair_start[starts_of_cells]
+        labels = pair_parent[starts_of_cells]
+        best_rule = pair_rule[best_pair]
+        # Offset index k - 1 splits the span after words[i + k - 1]
+        best_split = cell_starts + best_offset[best_pair]
+
+        span_scores = np.full((len(starts[0]), K), -np.inf)
+        span_scores[cell_starts, labels] = max_scores
+        if(beam is not None and beam < K):
+            beam_threshold = np.partition(span_scores, K - beam, axis = 1)[:, K - beam]
+            span_scores[span_scores < beam_threshold[:, None]] = -np.inf
+        pi[starts[0], starts[0] + l - 1] = span_scores
+        bp_rule[cell_starts, cell_starts + l - 1, labels] = best_rule
+        bp_split[cell_starts, cell_starts + l - 1, labels] = best_split
+
+    return pi, bp_rule, bp_split
+
+def MaxOutside(words, grammar, pi):
+    """Computes the max-product outside scores of the sentence given its Viterbi chart
+
+    outside[i, j, X] + pi[i, j, X] is the log probability of the best tree of the sentence in
+    which X spans words[i .. j]. Same recursion as Outside with max instead of sum.
+
+    """
+    n = len(words)
+    K = len(grammar.N)
+    outside = np.full((n, n, K), -np.inf)
+    outside[0, n - 1, grammar.RootCandidates(pi[0, n - 1])] = 0.0
+
+    flat_outside = outside.reshape(-1)
+    for l in range(n, 1, -1):
+        starts, offsets = spanIndices(n, l)
+        left_cells = pi[starts, starts + offsets - 1]
+        right_cells = pi[starts + offsets, starts + l - 1]
+
+        # Only the (start, rule) pairs whose parent has a tree above it and whose children are
+        # alive in some split, as in viterbiChart
+        parent_alive = np.isfinite(outside[starts[0], starts[0] + l - 1])
+        left_alive = np.any(np.isfinite(left_cells), axis = 0)
+        right_alive = np.any(np.isfinite(right_cells), axis = 0)
+        alive = (parent_alive[:, grammar.parent] & left_alive[:, grammar.left] &
+                right_alive[:, grammar.right])
+        pair_start, pair_rule = np.nonzero(alive)
+        if(len(pair_rule) == 0):
+            continue
+        pair_left, pair_right = grammar.left[pair_rule], grammar.right[pair_rule]
+
+        # Shape: (split offsets, pairs)
+        parent_scores = (outside[pair_start, pair_start + l - 1, grammar.parent[pair_rule]] +
+                grammar.log_prob[pair_rule])
+        to_left = parent_scores + right_cells[:, pair_start, pair_right]
+        to_right = parent_scores + left_cells[:, pair_start, pair_left]
+
+        # Flat indices of the child cells (i, i + k - 1, Y) and (i + k, j, Z)
+        left_index = (pair_start * n + pair_start + offsets - 1) * K + pair_left
+        right_index = ((pair_start + offsets) * n + pair_start + l - 1) * K + pair_right
+        np.maximum.at(flat_outside, left_index.reshape(-1), to_left.reshape(-1))
+        np.maximum.at(flat_outside, right_index.reshape(-1), to_right.reshape(-1))
+
+    return outside
+
+def MaxMarginals(words, grammar):
+    """Returns the max-marginals of all the labelled spans of the sentence
+
+    max_marginals[i, j, X] is the probability of the best tree in which X spans words[i .. j]
+    divided by the probability of the Viterbi tree: 1 for the spans of the Viterbi tree, 0 for
+    the spans of no tree. Takes the place of Marginals for pruning at a fraction of its cost:
+    max-product only, and both passes only score the rules of live cells.
+
+    """
+    n = len(words)
+    pi, bp_rule, bp_split = viterbiChart(words, grammar)
+    root_candidates = grammar.RootCandidates(pi[0, n - 1])
+    if(len(root_candidates) == 0):
+        return np.zeros(pi.shape)
+    best = np.max(pi[0, n - 1, root_candidates])
+    outside = MaxOutside(words, grammar, pi)
+    return np.exp(pi + outside - best)
+
+def viterbiTree(words, grammar, bp_rule, bp_split, X, i, j):
+    """Builds the tree rooted at X over the span (i, j) out of the back pointers"""
+    if(i == j):
+        return [grammar.N[X], words[i]]
+    rule, s = bp_rule[i, j, X], bp_split[i, j, X]
+    return [grammar.N[X],
+            viterbiTree(words, grammar, bp_rule, bp_split, grammar.left[rule], i, s),
+            viterbiTree(words, grammar, bp_rule, bp_split, grammar.right[rule], s + 1, j)]
+
+def CoarseToFine(words, coarse_words, coarse_grammar, fine_grammar, threshold = 1e-4):
+    """Parses with the fine grammar in the cells that survive the coarse max-marginals
+
+    The max-marginals of the coarse grammar (q5, or a smaller grammar written by
+    compact_grammar.py) are turned into a mask for the fine grammar (q6), which only scores its
+    rules in the cells the mask keeps. `coarse_words` is the same sentence with the rare words of
+    the coarse grammar replaced. If pruning removes every tree, the sentence is reparsed without
+    the mask. Returns None if the sentence has no parse at all. The coarse pass costs about as much as a Viterbi pass with the coarse grammar, so
+    this only pays off when the coarse grammar is much smaller than the fine one.
+
+    """
+    marginals = MaxMarginals(coarse_words, coarse_grammar)
+    mask = ProjectMask(mask = PruningMask(marginals = marginals, threshold = threshold),
+            coarse_grammar = coarse_grammar, fine_grammar = fine_grammar)
+    parse_tree_as_json = Viterbi(words, fine_grammar, mask = mask)
+    if(parse_tree_as_json is None):
+        parse_tree_as_json = Viterbi(words, fine_grammar)
+    return parse_tree_as_json
+
+def ParseTestData(test_data_file_name = None, counts_file_name = None,
+        test_predictions_file_name = None, mode = "posterior", coarse_counts_file_name = None,
+        threshold = 1e-4):
+    """Computes the parse trees for the test data with inside-outside
+
+    `mode` is either "posterior" for max-recall decoding with the grammar of `counts_file_name`,
+    or "pruned" for a Viterbi pass with that grammar restricted by the posteriors of the grammar
+    of `coarse_counts_file_name`.
+
+    """
+    assert(mode == "posterior" or mode == "pruned")
+
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    grammar = Grammar(*GetQ(counts_file_name = counts_file_name))
+
+    if(mode == "pruned"):
+        coarse_all_words = GetAllWords(counts_file_name = coarse_counts_file_name)
+        coarse_grammar = Grammar(*GetQ(counts_file_name = coarse_counts_file_name))
+
+    with open(test_data_file_name, "r") as f_test_data_input, open(test_predictions_file_name, "w+") as f_test_data_output:
+        for line in f_test_data_input:
+            words = line.strip().split()
+
+            if(mode == "posterior"):
+                PreprocessRareWords(words = words, all_words = all_words)
+                parse_tree_as_json = PosteriorDecode(words, grammar)
+            else:
+                # Both grammars keep the same tokens, only their rare words may differ
+                coarse_words = list(words)
+                PreprocessRareWords(words = coarse_words, all_words = coarse_all_words)
+                PreprocessRareWords(words = words, all_words = all_words)
+                parse_tree_as_json = CoarseToFine(words, coarse_words, coarse_grammar, grammar,
+                        threshold = threshold)
+
+            # Same as CKY, which asserts that every sentence has a root
+            assert(parse_tree_as_json is not None)
+            f_test_data_output.write(parse_tree_as_json + "\n")
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python inside_outside.py posterior parse_train.RARE.dat parse_dev.dat q5_posterior_file
+    # python inside_outside.py pruned parse_train_vert.RARE.dat parse_dev.dat q6_pruned_file \
+    #       parse_train.RARE.dat [threshold] [coarse_min_count]
+    # coarse_min_count compacts the coarse grammar as compact_grammar.py does
+    mode = sys.argv[1]
+    train_file_name = sys.argv[2]
+    test_file_name = sys.argv[3]
+    test_predictions_file_name = sys.argv[4]
+    counts_file_name = "cfg_io.counts"
+    coarse_counts_file_name = None
+    threshold = 1e-4
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    if(mode == "pruned"):
+        coarse_train_file_name = sys.argv[5]
+        if(len(sys.argv) > 6):
+            threshold = float(sys.argv[6])
+        coarse_counts_file_name = "cfg_io_coarse.counts"
+        cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                            coarse_train_file_name, coarse_counts_file_name)
+        os.system(cmd_counts_file_generation)
+
+        if(len(sys.argv) > 7):
+            # compact_grammar imports this module, so it can only be imported here
+            from compact_grammar import CompactCounts
+            from em_train import ReadCounts, WriteCounts
+            nonterm_counts, unary_counts, binary_counts = CompactCounts(
+                    *ReadCounts(counts_file_name = coarse_counts_file_name),
+                    min_count = float(sys.argv[7]))
+            WriteCounts(counts_file_name = coarse_counts_file_name, nonterm_counts = nonterm_counts,
+                    unary_counts = unary_counts, binary_counts = binary_counts)
+
+    ParseTestData(test_data_file_name = test_file_name, counts_file_name = counts_file_name,
+            test_predictions_file_name = test_predictions_file_name, mode = mode,
+            coarse_counts_file_name = coarse_counts_file_name, threshold = threshold)
+
+    # Delete the counts files
+    os.system("rm -rf %s %s" % (counts_file_name, coarse_counts_file_name or ""))
+
+    # Generate the evaluation results
+    cmd_generate_evaluation_results = "python eval_parser.py parse_dev.key %s" % (
+                                    test_predictions_file_name)
+    os.system(cmd_generate_evaluation_results)
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+import json
+import sys
+import os
+import time
+from multiprocessing import Pool
+
+from q5 import GetQ, GetAllWords, PreprocessRareWords
+from inside_outside import Grammar, Viterbi, ROOT_NON_TERMINAL
+from batch_scheduler import FlatTree
+from compact_grammar import SpanF1
+from treebank import Treebank, Sentences
+
+# Sentence internal punctuation that separates clauses in the treebank (tagged '.')
+BOUNDARY_WORDS = {";", ":", "--"}
+
+# Punctuation that starts a new chunk when a coordinating conjunction follows it. The other
+# tokens tagged '.' (quotes, -, `) and _RARE_ do not separate clauses.
+CLAUSE_PUNCTUATION = {",", ";", ":", "--"}
+
+# Grammar used by the worker processes, set once by initWorker
+worker_grammar = None
+
+def SplitPoints(words, conjunctions = None, punctuation = None):
+    """Returns the positions where a new chunk of the sentence can start
+
+    A chunk starts at a sentence internal ;, : or --, and at a punctuation mark followed by a
+    coordinating conjunction (", but"). In the treebank these attach as the left child of the
+    clause that follows them, so they start the next chunk.
+
+    """
+    split_points = list()
+    for i in range(1, len(words) - 1):
+        if(words[i] in BOUNDARY_WORDS or
+                (words[i] in punctuation and words[i + 1] in conjunctions)):
+            split_points.append(i)
+    return split_points
+
+def Chunks(words, split_points = None, min_chunk = 3):
+    """Cuts the sentence at the split points, skipping the ones that leave a chunk too short"""
+    chunks = list()
+    start = 0
+    for i in split_points:
+        if(i - start >= min_chunk and len(words) - i >= min_chunk):
+            chunks.append(words[start:i])
+            start = i
+    chunks.append(words[start:])
+    return chunks
+
+def JoinTrees(trees, q_binary_rules = None):
+    """Joins the trees of consecutive chunks into one right branching tree
+
+    Every join uses a top level binary rule X -> Y Z of the grammar where Y and Z are the roots of
+    the two parts: S when the grammar has S -> Y Z, the most probable such X otherwise, and S if
+    the grammar has no such rule.
+
+    """
+    # Indexed by (Y, Z): list of (q, X)
+    parents = dict()
+    for (X, Y, Z), q in q_binary_rules.items():
+        parents.setdefault((Y, Z), list()).append((q, X))
+
+    tree = trees[-1]
+    for left in reversed(trees[:-1]):
+        candidates = parents.get((left[0], tree[0]), [])
+        if(any(X == ROOT_NON_TERMINAL for q, X in candidates) or len(candidates) == 0):
+            X = ROOT_NON_TERMINAL
+        else:
+            X = max(candidates)[1]
+        tree = [X, left, tree]
+    return tree
+
+def initWorker(grammar):
+    """Stores the grammar in the worker process"""
+    global worker_grammar
+    worker_grammar = grammar
+
+def parseChunk(words):
+    """Parses one chunk in a worker process, returns the tree (not as JSON)"""
+    parse_tree_as_json = Viterbi(words, worker_grammar)
+    if(parse_tree_as_json is None):
+        parse_tree_as_json = FlatTree(words, worker_grammar)
+    return json.loads(parse_tree_as_json)
+
+def ParseSentences(sentences = None, q_binary_rules = None, q_unary_rules = None, N = None,
+        min_length = 40, processes = None):
+    """Parses the sentences, splitting the ones longer than `min_length` words into chunks
+
+    The chunks of all the sentences are parsed independently in a process pool and the trees of
+    the chunks of a sentence are joined with JoinTrees. Sentences up to `min_length` words are
+    parsed whole. Returns the trees and the number of sentences that were split.
+
+    """
+    grammar = Grammar(q_binary_rules, q_unary_rules, N)
+    conjunctions = {W for X, W in q_unary_rules if X == "CONJ" and W != "_RARE_"}
+    punctuation = {W for X, W in q_unary_rules if X == "." and W in CLAUSE_PUNCTUATION}
+
+    chunks = list()
+    chunks_of_sentence = list()
+    for words in sentences:
+        if(len(words) > min_length):
+            sentence_chunks = Chunks(words, split_points = SplitPoints(words,
+                conjunctions = conjunctions, punctuation = punctuation))
+        else:
+            sentence_chunks = [words]
+        chunks_of_sentence.append(len(sentence_chunks))
+        chunks.extend(sentence_chunks)
+
+    # Longest chunks first, the pool fills the gaps with the short ones
+    order = sorted(range(len(chunks)), key = lambda k: len(chunks[k]), reverse = True)
+    chunk_trees = [None] * len(chunks)
+    with Pool(processes = processes, initializer = initWorker, initargs = (grammar,)) as pool:
+        for k, tree in zip(order, pool.imap(parseChunk, [chunks[k] for k in order])):
+            chunk_trees[k] = tree
+
+    trees = list()
+    start = 0
+    for count in chunks_of_sentence:
+        trees.append(JoinTrees(chunk_trees[start:start + count], q_binary_rules = q_binary_rules))
+        start += count
+    return trees, sum(1 for count in chunks_of_sentence if count > 1)
+
+def CompareWithFullParsing(test_data_file_name = None, counts_file_name = None,
+        key_file_name = None, min_length = 40, processes = None):
+    """Prints the F1 and the time of full parsing against chunked parsing of the test data"""
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    q_binary_rules, q_unary_rules, N = GetQ(counts_file_name = counts_file_name)
+    key_trees = list(Treebank(key_file_name))
+
+    sentences = list()
+    for words in Sentences(test_data_file_name):
+        PreprocessRareWords(words = words, all_words = all_words)
+        sentences.append(words)
+
+    print("%12s  %10s  %10s  %10s" % ("Mode", "Split", "Seconds", "F1 Score"))
+    print("===============================================")
+    for mode, mode_min_length in [("full", len(max(sentences, key = len))),
+            ("chunked", min_length)]:
+        start_time = time.time()
+        trees, split = ParseSentences(sentences = sentences, q_binary_rules = q_binary_rules,
+                q_unary_rules = q_unary_rules, N = N, min_length = mode_min_length,
+                processes = processes)
+        print("%12s  %10d  %10.1f  %10.3f" % (mode, split, time.time() - start_time,
+            SpanF1(key_trees = key_trees, prediction_trees = trees)))
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # Parse:  python long_sentences.py parse parse_train.RARE.dat parse_dev.dat q5_prediction_file [min_length]
+    # Report: python long_sentences.py report parse_train.RARE.dat parse_dev.dat parse_dev.key [min_length]
+    mode = sys.argv[1]
+    train_file_name = sys.argv[2]
+    test_file_name = sys.argv[3]
+    output_file_name = sys.argv[4]
+    min_length = int(sys.argv[5]) if(len(sys.argv) > 5) else 40
+    counts_file_name = "cfg_long.counts"
+
+    cmd_counts_file_generation = "./count_cfg_freq.py %s > %s" % (
+                                        train_file_name, counts_file_name)
+    os.system(cmd_counts_file_generation)
+
+    if(mode == "parse"):
+        all_words = GetAllWords(counts_file_name = counts_file_name)
+        sentences = list()
+        for words in Sentences(test_file_name):
+            PreprocessRareWords(words = words, all_words = all_words)
+            sentences.append(words)
+        q_binary_rules, q_unary_rules, N = GetQ(counts_file_name = counts_file_name)
+        trees, split = ParseSentences(sentences = sentences, q_binary_rules = q_binary_rules,
+                q_unary_rules = q_unary_rules, N = N, min_length = min_length)
+        with open(output_file_name, "w+") as f_output:
+            for tree in trees:
+                f_output.write(json.dumps(tree) + "\n")
+    elif(mode == "report"):
+        CompareWithFullParsing(test_data_file_name = test_file_name,
+                counts_file_name = counts_file_name, key_file_name = output_file_name,
+                min_length = min_length)
+
+    # Delete the counts file
+    os.system("rm -rf %s" % (counts_file_name))
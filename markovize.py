@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+import json
+import sys
+
+from inside_outside import Grammar, Viterbi, simplify_non_terminal
+from treebank import Treebank, Sentences
+from count_store import CountStore
+from compact_grammar import SpanF1
+from batch_scheduler import FlatTree
+from q5 import PreprocessRareWords
+
+def SplitLabel(label):
+    """Splits a label into its phrase and the rest of a collapsed unary rule: NP+NOUN -> NP, +NOUN"""
+    if("+" in label):
+        index = label.index("+")
+        return label[:index], label[index:]
+    return label, ""
+
+def StripTree(tree):
+    """Removes the markovization from all the labels of the tree, in place"""
+    tree[0] = simplify_non_terminal(tree[0])
+    if(len(tree) == 3):
+        StripTree(tree[1])
+        StripTree(tree[2])
+    return tree
+
+def isIntermediate(tree, parent_label):
+    """True if the node was introduced by the binarization of its parent
+
+    The trees do not mark these nodes. The binarization is right branching, so a binary node
+    that is the right child of a node with the same label is taken as intermediate (NP -> DET NP
+    for a flat NP -> DET NOUN NOUN). This also catches the rare real X -> Y X constituents.
+
+    """
+    return len(tree) == 3 and tree[0] == parent_label
+
+def annotate(tree, ancestors, history, vertical_order, horizontal_order):
+    """Returns the markovized copy of the tree
+
+    `ancestors` are the labels of the enclosing constituents, nearest first, and `history` the
+    labels of the left siblings already generated by the binarization of the current constituent.
+
+    """
+    label = tree[0]
+    phrase, rest = SplitLabel(label)
+
+    # Preterminals (X -> word without a collapsed unary rule) are never annotated
+    if(len(tree) == 2 and rest == ""):
+        return [label, tree[1]]
+
+    if(len(tree) == 2):
+        # Collapsed unary rule: the annotation goes on the phrase, NP^<VP>+NOUN
+        context = ancestors[:vertical_order - 1]
+        marker = "^<%s>" % (",".join(context)) if(len(context) != 0) else ""
+        return [phrase + marker + rest, tree[1]]
+
+    if(history is None):
+        # A real constituent: vertical markovization with its own ancestors
+        context = ancestors[:vertical_order - 1]
+        marker = "^<%s>" % (",".join(context)) if(len(context) != 0) else ""
+        child_ancestors = [phrase] + ancestors
+        new_label = phrase + marker + rest
+        history = list()
+    else:
+        # An intermediate symbol: horizontal markovization with its left siblings
+        context = history[len(history) - horizontal_order:] if(horizontal_order > 0) else []
+        marker = "|<%s>" % (",".join(context)) if(len(context) != 0) else ""
+        child_ancestors = ancestors
+        new_label = label + marker
+
+    left, right = tree[1], tree[2]
+    new_left = annotate(left, child_ancestors, None, vertical_order, horizontal_order)
+    if(isIntermediate(right, label)):
+        new_right = annotate(right, child_ancestors, history + [SplitLabel(left[0])[0]],
+                vertical_order, horizontal_order)
+    else:
+        new_right = annotate(right, child_ancestors, None, vertical_order, horizontal_order)
+    return [new_label, new_left, new_right]
+
+def Markovize(tree, vertical_order = 2, horizontal_order = 0):
+    """Returns the tree with parent annotation and horizontal markovization
+
+    `vertical_order` = 1 leaves the labels as they are, 2 annotates every constituent with its
+    parent (NP^<S>, the annotation of parse_train_vert.dat), 3 with its parent and grandparent
+    (NP^<VP,S>), and so on. Intermediate symbols of the binarization inherit the ancestors of their
+    constituent and are annotated with the last `horizontal_order` left siblings instead
+    (NP|<DET>); 0 keeps them bare. simplify_non_terminal removes both annotations.
+
+    """
+    return annotate(tree, [], None, vertical_order, horizontal_order)
+
+def MarkovizeFile(input_file_name = None, output_file_name = None, vertical_order = 2,
+        horizontal_order = 0):
+    """Markovizes every tree of the training file, written in JSON format like q4's output"""
+    with Treebank(input_file_name) as trees, open(output_file_name, "w+") as f_output:
+        for tree in trees:
+            f_output.write(json.dumps(Markovize(tree, vertical_order = vertical_order,
+                horizontal_order = horizontal_order)) + "\n")
+
+def StripFile(input_file_name = None, output_file_name = None):
+    """Removes the markovization from every tree of a prediction file"""
+    with Treebank(input_file_name) as trees, open(output_file_name, "w+") as f_output:
+        for tree in trees:
+            f_output.write(json.dumps(StripTree(tree)) + "\n")
+
+def MarkovizationReport(train_file_name = None, test_data_file_name = None, key_file_name = None,
+        orders = ((1, 0), (2, 0), (2, 1), (2, 2), (3, 0), (3, 1))):
+    """Prints the grammar size and the F1 of the test data for every (vertical, horizontal) order
+
+    The counts are those of q4 + count_cfg_freq.py on the markovized trees (see CountStore), the
+    test data is parsed with the vectorized CKY and the markers are stripped before scoring.
+
+    """
+    trees = list(Treebank(train_file_name))
+    sentences = list(Sentences(test_data_file_name))
+    key_trees = list(Treebank(key_file_name))
+
+    print("%10s  %10s  %10s  %10s  %10s" % ("Vertical", "Horizontal", "NonTerm", "Binary",
+        "F1 Score"))
+    print("===============================================================")
+    for vertical_order, horizontal_order in orders:
+        store = CountStore()
+        store.AddTrees(Markovize(tree, vertical_order = vertical_order,
+            horizontal_order = horizontal_order) for tree in trees)
+        q_binary_rules, q_unary_rules, N = store.GetQ()
+        grammar = Grammar(q_binary_rules, q_unary_rules, N)
+        all_words = store.GetAllWords()
+
+        predictions = list()
+        for sentence in sentences:
+            words = list(sentence)
+            PreprocessRareWords(words = words, all_words = all_words)
+            parse_tree_as_json = Viterbi(words, grammar)
+            if(parse_tree_as_json is None):
+                parse_tree_as_json = FlatTree(words, grammar)
+            predictions.append(StripTree(json.loads(parse_tree_as_json)))
+        print("%10d  %10d  %10d  %10d  %10.3f" % (vertical_order, horizontal_order, len(N),
+            len(q_binary_rules), SpanF1(key_trees = key_trees, prediction_trees = predictions)))
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE:
+    # python markovize.py annotate parse_train.dat parse_train_v2h1.dat 2 1
+    # python markovize.py strip q6_prediction_file q6_prediction_file.stripped
+    # python markovize.py report parse_train.dat parse_dev.dat parse_dev.key
+    mode = sys.argv[1]
+    input_file_name = sys.argv[2]
+    output_file_name = sys.argv[3]
+
+    if(mode == "annotate"):
+        MarkovizeFile(input_file_name = input_file_name, output_file_name = output_file_name,
+                vertical_order = int(sys.argv[4]), horizontal_order = int(sys.argv[5]))
+    elif(mode == "strip"):
+        StripFile(input_file_name = input_file_name, output_file_name = output_file_name)
+    elif(mode == "report"):
+        MarkovizationReport(train_file_name = input_file_name, test_data_file_name = sys.argv[3],
+                key_file_name = sys.argv[4])
@@ -4,6 +4,8 @@ import json
 import sys
 import os
 
+from treebank import Treebank
+
 def getRareWords(file_name = None):
     """Return a list of rare words given the file name
 
@@ -83,14 +85,16 @@ def ReplaceRareWords(input_file_name = None, output_file_name = None, rare_words
     if it is present in rare_words (list), replaces it with a reserved keyword - _RARE_. Writes  
     the new data into `output_file_name`
 
+    The training file is read through a Treebank, so the trees are decoded one at a time from the
+    memory mapped file.
+
     The old training and the new training files are written in JSON format.
 
     """
     # The output file name is opened for writing. Replaced if exists. Created if doesn't exist
-    with open(input_file_name, "r") as f_input, open(output_file_name, "w+") as f_output:
+    with Treebank(input_file_name) as f_input, open(output_file_name, "w+") as f_output:
         
-        for line_number, line in enumerate(f_input):
-            tree = json.loads(line)
+        for tree in f_input:
 
             ######################################
             # Each `tree` is a list
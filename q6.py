@@ -4,6 +4,8 @@ import json
 import sys
 import os
 
+from span_constraints import SpanConstraints
+
 def GetQ(counts_file_name = None):
     """Reads the counts file and returns the parameters of underlying CFG
     
@@ -23,22 +25,23 @@ def GetQ(counts_file_name = None):
 
     # In the initial iteration, q_binary_rules, q_unary_rules store the counts
     # In the next iteration, these counts are divided by counts of the non-terminals
+    # The counts are read as floats: grammars re-estimated with EM have expected counts
     ################ FIRST ITERATION #####################
     with open(counts_file_name, "r") as f_counts:
         for line in f_counts:
             tokens = line.strip().split()
             if(tokens[1] == "NONTERMINAL"):
                 non_terminal = tokens[2]
-                count_non_terminal = int(tokens[0])
+                count_non_terminal = float(tokens[0])
                 q_non_terminal[non_terminal] = count_non_terminal
              
             elif(tokens[1] == "BINARYRULE"):
-                count_binary_rule = int(tokens[0])
+                count_binary_rule = float(tokens[0])
                 X, Y1, Y2 = tokens[2], tokens[3], tokens[4]
                 q_binary_rules[(X, Y1, Y2)] = count_binary_rule
              
             elif(tokens[1] == "UNARYRULE"):
-                count_unary_rule = int(tokens[0])
+                count_unary_rule = float(tokens[0])
                 X, W = tokens[2], tokens[3]
                 q_unary_rules[(X, W)] = count_unary_rule
         
@@ -128,19 +131,25 @@ def toJSONArray(bp = None, root_val = None, n = None):
 
     return json_array
 
-def CKY(words, q_binary_rules, q_unary_rules, N):
+def CKY(words, q_binary_rules, q_unary_rules, N, constraints = None):
     """Runs the dynamic programming based CKY on the given sentence
     The `words` has been preprocessed already to replace rare words with keyword rare.
+    With `constraints` (a SpanConstraints), the cells and the split points that cannot be part of
+    any parse are skipped; the parse tree is the same.
     """
     # Indexed by start and end point and the non-terminal spanning the range
     pi = dict()
     bp = dict()
 
+    # Cells allowed by the span constraints, None if every cell is allowed
+    mask = constraints.Mask(len(words)) if(constraints is not None) else None
+
     #################### INITIALIZATION ##########################
     for i in range(len(words)):
         for X in N:
             rule = (X, words[i])
-            if(rule in q_unary_rules):
+            if(rule in q_unary_rules and
+                    (mask is None or mask[i, i, constraints.nt_index[X]])):
                 pi[(i, i, X)] = q_unary_rules[(X, words[i])]
                 bp[(i, i, X)] = ((X, words[i]), -1)
             else:
@@ -157,6 +166,8 @@ def CKY(words, q_binary_rules, q_unary_rules, N):
 
             for X in N:
                 pi[(i, j, X)] = 0
+                if(mask is not None and not mask[i, j, constraints.nt_index[X]]):
+                    continue
 
                 # Stores the binary rule that gives the max probability
                 max_binary_rule = None
@@ -165,8 +176,16 @@ def CKY(words, q_binary_rules, q_unary_rules, N):
                 
                 flag = False 
                 
-                for binary_rule in getBinaryRulesFor(q_binary_rules, X):
-                    for s in range(i, j):
+                if(constraints is None):
+                    binary_rules = getBinaryRulesFor(q_binary_rules, X)
+                else:
+                    binary_rules = constraints.binary_rules_for[X]
+                for binary_rule in binary_rules:
+                    if(constraints is None):
+                        split_points = range(i, j)
+                    else:
+                        split_points = constraints.SplitRange(i, j, binary_rule)
+                    for s in split_points:
                         X_, Y, Z = binary_rule
 
                         # Should always evalulate to true
@@ -222,6 +241,9 @@ def ParseTestData(test_data_file_name = None, counts_file_name = None,
     # Calculate the parameters of the model
     q_binary_rules, q_unary_rules, N = GetQ(counts_file_name = counts_file_name)
 
+    # Cells that cannot be part of any parse are skipped, the parse trees are the same
+    constraints = SpanConstraints(q_binary_rules, q_unary_rules, N)
+
 #    # Sanity checks on probabilty
 #    for binary_rule in q_binary_rules:
 #        assert(q_binary_rules[binary_rule] > 0)
@@ -237,7 +259,8 @@ def ParseTestData(test_data_file_name = None, counts_file_name = None,
             PreprocessRareWords(words = words, all_words = all_words)
             
             # Run the CKY on this sentence
-            parse_tree_as_json = CKY(words, q_binary_rules, q_unary_rules, N)
+            parse_tree_as_json = CKY(words, q_binary_rules, q_unary_rules, N,
+                    constraints = constraints)
             
             # Write the JSON to the prediction file
             f_test_data_output.write(parse_tree_as_json + "\n")
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import sys
+import time
+
+import numpy as np
+
+from treebank import Sentences
+
+def YieldBounds(q_binary_rules = None, q_unary_rules = None, N = None):
+    """Returns the minimum and maximum number of words every non-terminal can span
+
+    Computed as a fixpoint over the rules: a non-terminal with a unary rule spans one word, and
+    X -> Y Z spans between min(Y) + min(Z) and max(Y) + max(Z) words. A non-terminal that can
+    derive itself (e.g. NP -> NP PP) has no maximum, stored as infinity. Preterminals such as
+    NP+PRON or ADVP+ADV, which have no binary rules, get a maximum of 1.
+
+    """
+    min_length = {X: np.inf for X in N}
+    max_length = {X: 0 for X in N}
+    for X, W in q_unary_rules:
+        min_length[X] = 1
+        max_length[X] = 1
+
+    # Minimum: shortest derivation, a Bellman-Ford style fixpoint
+    changed = True
+    while(changed):
+        changed = False
+        for X, Y, Z in q_binary_rules:
+            if(min_length[Y] + min_length[Z] < min_length[X]):
+                min_length[X] = min_length[Y] + min_length[Z]
+                changed = True
+
+    # Maximum: unbounded if X reaches a non-terminal on a cycle, longest derivation otherwise
+    children = {X: set() for X in N}
+    for X, Y, Z in q_binary_rules:
+        if(min_length[Y] != np.inf and min_length[Z] != np.inf):
+            children[X].update((Y, Z))
+    reachable = dict()
+    for X in N:
+        seen = set()
+        stack = list(children[X])
+        while(len(stack) != 0):
+            Y = stack.pop()
+            if(Y not in seen):
+                seen.add(Y)
+                stack.extend(children[Y])
+        reachable[X] = seen
+    on_cycle = {X for X in N if X in reachable[X]}
+    for X in N:
+        if(X in on_cycle or len(reachable[X] & on_cycle) != 0):
+            max_length[X] = np.inf
+
+    # The remaining non-terminals only derive through a DAG: longest first by depth
+    bounded = [X for X in N if max_length[X] != np.inf]
+    for X in sorted(bounded, key = lambda X: len(reachable[X])):
+        for rule_X, Y, Z in q_binary_rules:
+            if(rule_X == X and Y in children[X] and Z in children[X]):
+                max_length[X] = max(max_length[X], max_length[Y] + max_length[Z])
+    return min_length, max_length
+
+def SiblingRoom(q_binary_rules = None, min_length = None, N = None):
+    """Returns the number of words a non-terminal needs beside it when it is not the root
+
+    As a left child, X -> ... is followed by a right sibling Z of at least min(Z) words; as a
+    right child it is preceded by a left sibling of at least min(Y) words. A non-terminal that is
+    never a left (right) child gets infinity on that side.
+
+    """
+    room_right = {X: np.inf for X in N}
+    room_left = {X: np.inf for X in N}
+    for X, Y, Z in q_binary_rules:
+        room_right[Y] = min(room_right[Y], min_length[Z])
+        room_left[Z] = min(room_left[Z], min_length[Y])
+    return room_left, room_right
+
+class SpanConstraints:
+    """Exact pruning of the cells of the chart from the shape of the grammar
+
+    A non-terminal X can only be in the cell (i, j) of a sentence of n words if the span length
+    is within the yield bounds of X, and, unless (i, j) is the whole sentence, there is room for
+    the sibling X needs: at least room_left[X] words before i or room_right[X] words after j.
+    Cells that fail these tests cannot be part of any tree rooted at (0, n - 1), so pruning them
+    does not change the Viterbi tree. The mask only depends on n and is cached.
+
+    Usage:
+        constraints = SpanConstraints(q_binary_rules, q_unary_rules, N)
+        parse_tree_as_json = CKY(words, q_binary_rules, q_unary_rules, N, constraints = constraints)
+
+    """
+    def __init__(self, q_binary_rules, q_unary_rules, N):
+        self.N = list(N)
+        min_length, max_length = YieldBounds(q_binary_rules = q_binary_rules,
+                q_unary_rules = q_unary_rules, N = self.N)
+        room_left, room_right = SiblingRoom(q_binary_rules = q_binary_rules,
+                min_length = min_length, N = self.N)
+        self.min_length = np.array([min_length[X] for X in self.N], dtype = np.float64)
+        self.max_length = np.array([max_length[X] for X in self.N], dtype = np.float64)
+        self.room_left = np.array([room_left[X] for X in self.N], dtype = np.float64)
+        self.room_right = np.array([room_right[X] for X in self.N], dtype = np.float64)
+        self.masks = dict()
+
+        # Indexed by a non-terminal: its binary rules, in the order CKY tries them
+        self.binary_rules_for = {X: list() for X in self.N}
+        for rule in q_binary_rules:
+            self.binary_rules_for[rule[0]].append(rule)
+        self.nt_index = {X: index for index, X in enumerate(self.N)}
+
+    def Mask(self, n):
+        """Returns the boolean mask (n, n, |N|) of the cells allowed in a sentence of n words"""
+        if(n not in self.masks):
+            i = np.arange(n)[:, None, None]
+            j = np.arange(n)[None, :, None]
+            length = j - i + 1
+            fits = (length >= self.min_length) & (length <= self.max_length)
+            has_room = ((i >= self.room_left) | (n - 1 - j >= self.room_right) |
+                    ((i == 0) & (j == n - 1)))
+            self.masks[n] = fits & has_room & (j >= i)
+        return self.masks[n]
+
+    def SplitRange(self, i, j, binary_rule):
+        """Returns the split points s of X -> Y Z over (i, j) where both halves fit Y and Z
+
+        The left half has s - i + 1 words and the right half j - s words. The range is empty if Y
+        or Z derives no sentence at all.
+
+        """
+        X, Y, Z = binary_rule
+        Y_index, Z_index = self.nt_index[Y], self.nt_index[Z]
+        if(self.min_length[Y_index] == np.inf or self.min_length[Z_index] == np.inf):
+            return range(0)
+        first_s = int(max(i, i + self.min_length[Y_index] - 1, j - self.max_length[Z_index]))
+        last_s = int(min(j - 1, i + self.max_length[Y_index] - 1, j - self.min_length[Z_index]))
+        return range(first_s, last_s + 1)
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE: python span_constraints.py cfg_q5.counts parse_dev.dat [max_length]
+    # Prints the yield bounds, the share of the cells pruned on the test data and the time of
+    # CKY with and without the constraints on the sentences up to max_length words
+
+    # q5 imports this module for CKY, so q5 can only be imported here
+    from q5 import GetQ, GetAllWords, PreprocessRareWords, CKY
+    counts_file_name = sys.argv[1]
+    test_file_name = sys.argv[2]
+    max_test_length = int(sys.argv[3]) if(len(sys.argv) > 3) else 10
+
+    q_binary_rules, q_unary_rules, N = GetQ(counts_file_name = counts_file_name)
+    all_words = GetAllWords(counts_file_name = counts_file_name)
+    constraints = SpanConstraints(q_binary_rules, q_unary_rules, N)
+
+    for X, low, high in sorted(zip(constraints.N, constraints.min_length, constraints.max_length)):
+        print("%20s  %4s  %4s" % (X, "%d" % low if(low != np.inf) else "-",
+            "%d" % high if(high != np.inf) else "inf"))
+
+    cells = pruned = 0
+    plain_time = constrained_time = 0.0
+    for words in Sentences(test_file_name):
+        if(len(words) > max_test_length):
+            continue
+        PreprocessRareWords(words = words, all_words = all_words)
+        mask = constraints.Mask(len(words))
+        # Only the cells with i <= j are part of the chart
+        sentence_cells = len(words) * (len(words) + 1) // 2 * len(constraints.N)
+        cells += sentence_cells
+        pruned += sentence_cells - np.count_nonzero(mask)
+
+        start_time = time.time()
+        CKY(words, q_binary_rules, q_unary_rules, N)
+        plain_time += time.time() - start_time
+        start_time = time.time()
+        CKY(words, q_binary_rules, q_unary_rules, N, constraints = constraints)
+        constrained_time += time.time() - start_time
+
+    print("")
+    print("Pruned %.1f%% of the cells, CKY %.2fs -> %.2fs" % (100.0 * pruned / cells, plain_time,
+        constrained_time))
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+import json
+import mmap
+import os
+import sys
+from array import array
+
+# Offsets are 64 bit when the platform supports it (python 3), native longs otherwise
+try:
+    INDEX_TYPECODE = 'q'
+    array(INDEX_TYPECODE)
+except ValueError:
+    INDEX_TYPECODE = 'l'
+
+class Treebank:
+    """Random access to a file of trees (or sentences), one JSON tree per line
+
+    The file is memory mapped and never read as a whole. The byte offset of every line is kept in
+    a persistent index next to the file (`file_name`.idx) so that later runs do not have to scan
+    the file again; the index is rebuilt whenever the size or the modification time of the file
+    changes, or when it is not complete. Lines are only decoded when they are accessed.
+
+    Usage:
+        treebank = Treebank("parse_train.dat")
+        tree = treebank[10]
+        for tree in treebank.Shard(shard_index = 0, num_shards = 4): ...
+
+    """
+    def __init__(self, file_name, decode = json.loads):
+        self.file_name = file_name
+        self.index_file_name = file_name + ".idx"
+        self.decode = decode
+
+        self.f = open(file_name, "rb")
+        size = os.fstat(self.f.fileno()).st_size
+
+        # mmap cannot map an empty file
+        self.mm = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ) if(size > 0) else b""
+        self.offsets = self.loadIndex()
+        if(self.offsets is None):
+            self.offsets = self.buildIndex()
+            self.saveIndex()
+
+    def fileStamp(self):
+        """Returns the (size, modification time) pair the index is valid for"""
+        stat = os.fstat(self.f.fileno())
+        return [stat.st_size, int(stat.st_mtime * 1000000)]
+
+    def buildIndex(self):
+        """Scans the file once, returns the offsets of the starts of the lines plus the end"""
+        offsets = array(INDEX_TYPECODE)
+        start = 0
+        end_of_file = len(self.mm)
+        while(start < end_of_file):
+            end = self.mm.find(b"\n", start)
+            if(end == -1):
+                end = end_of_file
+            # Blank lines are not trees
+            if(self.mm[start:end].strip()):
+                offsets.append(start)
+                offsets.append(end)
+            start = end + 1
+        return offsets
+
+    def loadIndex(self):
+        """Returns the persisted offsets if they were built for the current file, None otherwise
+
+        The header of the index is the file stamp and the number of lines. The index is rejected
+        if it does not hold that many offsets or if its last line does not end the file, so a
+        truncated or stale index is rebuilt instead of trusted.
+
+        """
+        if(not os.path.exists(self.index_file_name)):
+            return None
+        stored = array(INDEX_TYPECODE)
+        with open(self.index_file_name, "rb") as f_index:
+            index_size = os.fstat(f_index.fileno()).st_size
+            if(index_size < 3 * stored.itemsize or index_size % stored.itemsize != 0):
+                return None
+            stored.fromfile(f_index, index_size // stored.itemsize)
+        if(list(stored[:2]) != self.fileStamp() or len(stored) != 3 + 2 * stored[2]):
+            return None
+        offsets = stored[3:]
+        last_end = offsets[-1] if(len(offsets) != 0) else 0
+        if(last_end > len(self.mm) or self.mm[last_end:].strip()):
+            return None
+        return offsets
+
+    def saveIndex(self):
+        """Writes the offsets to the index file, silently skipped if the directory is read only
+
+        The index is written to a temporary file first and then renamed, so that a reader never
+        sees a partial index, whether a concurrent writer or a crash left it.
+
+        """
+        stored = array(INDEX_TYPECODE, self.fileStamp() + [len(self.offsets) // 2])
+        stored.extend(self.offsets)
+        temp_file_name = "%s.%d.tmp" % (self.index_file_name, os.getpid())
+        try:
+            with open(temp_file_name, "wb") as f_index:
+                stored.tofile(f_index)
+            # os.replace is python 3 only, os.rename is atomic as well on POSIX
+            getattr(os, "replace", os.rename)(temp_file_name, self.index_file_name)
+        except (IOError, OSError):
+            if(os.path.exists(temp_file_name)):
+                os.remove(temp_file_name)
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+    def Line(self, k):
+        """Returns the k-th line as text, without decoding it"""
+        return self.mm[self.offsets[2 * k]:self.offsets[2 * k + 1]].decode("utf-8")
+
+    def __getitem__(self, k):
+        if(k < 0):
+            k += len(self)
+        if(k < 0 or k >= len(self)):
+            raise IndexError("Treebank: line %d out of range" % (k))
+        return self.decode(self.Line(k))
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def ShardRange(self, shard_index = 0, num_shards = 1):
+        """Returns the [start, stop) range of lines of the shard
+
+        The shards are contiguous blocks of lines of almost equal size, so that every worker reads
+        a single region of the file.
+
+        """
+        assert(0 <= shard_index < num_shards)
+        start = len(self) * shard_index // num_shards
+        stop = len(self) * (shard_index + 1) // num_shards
+        return start, stop
+
+    def Shard(self, shard_index = 0, num_shards = 1):
+        """Iterates lazily over the trees of one shard out of `num_shards`"""
+        start, stop = self.ShardRange(shard_index = shard_index, num_shards = num_shards)
+        for k in range(start, stop):
+            yield self[k]
+
+    def Close(self):
+        if(not isinstance(self.mm, bytes)):
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+def Sentences(file_name):
+    """Returns a Treebank of whitespace tokenized sentences, e.g. parse_dev.dat"""
+    return Treebank(file_name, decode = lambda line: line.split())
+
+if __name__ == "__main__":
+
+    # SAMPLE USAGE: python treebank.py parse_train.dat
+    # Builds (or checks) the index of the file and prints the number of trees
+    with Treebank(sys.argv[1]) as treebank:
+        print("%d trees in %s" % (len(treebank), sys.argv[1]))